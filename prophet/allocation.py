@@ -0,0 +1,99 @@
+"""Splits a distillery plan's quantity to manufacture / raise across depots.
+
+With ``"allocate": true`` a distillery or intent row also gets a "depots"
+list saying which depot should receive how much of the SKU's
+quantityToManufacture / quantitytoraise. Each depot's share follows its
+own need, forecast demand minus the closing stock at the depot and its
+primary retail shops (see hierarchy.py); when no depot is short the
+quantity follows forecast demand instead. Allocations are whole bottles
+and add up to the row's quantity exactly (largest remainder).
+
+A depot's forecast demand is its own base forecast in "hierarchical" mode.
+In "direct" mode there is one series per SKU, so its demand is split in
+proportion to each depot's primary-shop sales over the training window.
+All SKUs and depots of a plan are solved at once as (SKU x depot) arrays.
+"""
+import numpy as np
+
+
+def allocate(quantity, demand, stock):
+    """Integer (SKU x depot) split of ``quantity`` (one per SKU) by need,
+    or by ``demand`` for SKUs where no depot needs anything."""
+    quantity = np.asarray(quantity, dtype=float)
+    need = np.maximum(demand - stock, 0.0)
+    weights = np.where(need.sum(axis=1, keepdims=True) > 0, need, np.maximum(demand, 0.0))
+
+    total = weights.sum(axis=1, keepdims=True)
+    share = np.divide(weights, total, out=np.zeros_like(weights), where=total > 0)
+    exact = quantity[:, None] * share
+    allocated = np.floor(exact)
+
+    # Hand the bottles lost to rounding down to the largest remainders
+    left = np.rint(np.where(total[:, 0] > 0, quantity, 0.0) - allocated.sum(axis=1))
+    order = np.argsort(allocated - exact, axis=1, kind="stable")
+    rank = np.empty_like(order)
+    np.put_along_axis(rank, order, np.broadcast_to(np.arange(order.shape[1]), order.shape), axis=1)
+    return (allocated + (rank < left[:, None])).astype(np.int64)
+
+
+class DepotAllocation:
+    """Depots, their stock and how to get their demand, for one plan."""
+
+    def __init__(self, depots, stock, raise_field, shares=None, part_columns=None):
+        self.depots = depots
+        self.stock = stock                  # (SKU x depot) closing stock
+        self.raise_field = raise_field
+        self.shares = shares                # direct: split of the SKU demand
+        self.part_columns = part_columns    # hierarchical: depot of each part
+
+    def depot_demands(self, part_demands, skus):
+        """(SKU x depot) demand from (part x SKU) demands of the ``skus``
+        rows of the plan."""
+        part_demands = np.asarray(part_demands, dtype=float).reshape(-1, len(skus))
+        if self.shares is not None:
+            return part_demands.sum(axis=0)[:, None] * self.shares[skus]
+        demand = np.zeros((len(skus), len(self.depots)))
+        demand[:, self.part_columns] = part_demands.T
+        return demand
+
+    def add(self, rows, part_demands, skus=None):
+        """Add "depots" to ``rows`` (the plan's SKU rows ``skus``, default
+        all of them in order)."""
+        if skus is None:
+            skus = np.arange(len(rows))
+        demand = self.depot_demands(part_demands, skus)
+        stock = self.stock[skus]
+        allocated = allocate([row[self.raise_field] for row in rows], demand, stock)
+
+        demand = np.rint(demand).astype(np.int64)
+        stock = stock.astype(np.int64)
+        for row, row_demand, row_stock, row_allocated in zip(rows, demand, stock, allocated):
+            row["depots"] = [
+                {"depot": self.depots[j], "demand": int(row_demand[j]),
+                 "remaining_stock": int(row_stock[j]), self.raise_field: int(row_allocated[j])}
+                for j in np.flatnonzero((row_demand != 0) | (row_allocated != 0))
+            ]
+
+
+def depot_allocation(snapshot, depots, skus, train_start, train_end, raise_field, parts=None):
+    """DepotAllocation of a distillery plan; ``parts`` are its hierarchical
+    parts (labelled by depot), None in direct mode."""
+    base_shops = [list(snapshot.hierarchy.base_shops_for_depot(depot)) for depot in depots]
+    stock = snapshot.stock_index.group_totals(
+        [[depot, *shops] for depot, shops in zip(depots, base_shops)], skus
+    )
+
+    if parts is not None:
+        column = {depot: j for j, depot in enumerate(depots)}
+        return DepotAllocation(depots, stock, raise_field,
+                               part_columns=[column[part.label] for part in parts])
+
+    sales = snapshot.sales.group_totals(
+        [snapshot.sales.positions(shops) for shops in base_shops], skus, train_start, train_end
+    )
+    sales = np.maximum(sales, 0.0)
+    total = sales.sum(axis=1, keepdims=True)
+    # SKUs no depot sold in the window: split evenly
+    shares = np.divide(sales, total, out=np.full_like(sales, 1.0 / max(len(depots), 1)),
+                       where=total > 0)
+    return DepotAllocation(depots, stock, raise_field, shares=shares)
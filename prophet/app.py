@@ -1,9 +1,25 @@
-from flask import Flask, request, jsonify
-import pandas as pd
-from prophet import Prophet
-from datetime import datetime, timedelta
+import json
+import logging
+import os
+import queue
+import threading
+import time
+
+from flask import Flask, Response, request, jsonify
 from flask_cors import CORS
 
+from datastore import DataSnapshot, make_source
+import forecasting
+from backtest import backtest
+from engines import ENGINES, matrix_range_totals
+from executor import FitBudget, ForecastExecutor
+from jobs import JobQueue
+from materialize import (
+    ENABLED as MATERIALIZE_ENABLED, FITS as MATERIALIZE_FITS, ForecastStore, materialize_items
+)
+from model_cache import ModelCache
+from scopes import MAX_HORIZON, MODES, PLANNERS, ScopeError
+
 
 app = Flask(__name__)
 CORS(app, resources={r"/*": {"origins": "*"}}, supports_credentials=True)
@@ -12,143 +28,233 @@ CORS(app, resources={r"/*": {"origins": "*"}}, supports_credentials=True)
 # ---------------------------------------------------------
 # LOAD DATA
 # ---------------------------------------------------------
-retail = pd.read_csv("data/poc_retail.csv")
-wholesale = pd.read_csv("data/poc_wholesale.csv")
-stock = pd.read_csv("data/poc_stock_closing.csv")
+# Tables + hierarchy index, rebuilt by refresh_data(). Handlers take one
+# reference at the start of a request so a refresh never changes the data
+# underneath them.
+source = make_source()
+data = DataSnapshot(source.load())
+refresh_lock = threading.Lock()
 
-# ---------------------------------------------------------
-# FIX DATA TYPES
-# ---------------------------------------------------------
-retail["entity_code"] = retail["entity_code"].astype(str)
-wholesale["from_entity_code"] = wholesale["from_entity_code"].astype(str)
-wholesale["to_entity_code"] = wholesale["to_entity_code"].astype(str)
-stock["entity_code"] = stock["entity_code"].astype(str)
+REFRESH_SECONDS = float(os.getenv("PROPHET_REFRESH_SECONDS", "0"))
 
-retail["package_size"] = retail["package_size"].astype(str)
-stock["package_size"] = stock["package_size"].astype(str)
 
-# Fix dates
-retail['bill_date'] = pd.to_datetime(retail['bill_date'], errors='coerce')
-retail['ProductCategory'] = retail['brand_name'] + " | " + retail['package_size']
+def refresh_data(full=False):
+    """Pull new rows from the data source (every row when ``full``) and swap
+    in a new snapshot if anything changed."""
+    global data
+    with refresh_lock:
+        tables = source.load() if full else source.load_since(data.tables)
+        if tables is not None:
+            data = DataSnapshot(tables)
+            if MATERIALIZE_ENABLED:
+                schedule_materialize(data)
+        return data
 
 
-@app.route("/prophet/depot/predict", methods=["POST"])
-def predict():
-    req = request.json
-    months = req.get("month", 2)
-    from_month = req.get("from_month")    # NEW FIELD
-    depotid = str(req.get("id"))
+def refresh_loop():
+    while True:
+        time.sleep(REFRESH_SECONDS)
+        try:
+            refresh_data()
+        except Exception:
+            logging.exception("Background data refresh failed")
 
-    if depotid is None:
-        return jsonify({"error": "depotid is required"}), 400
 
-    if from_month is None:
-        return jsonify({"error": "from_month is required"}), 400
+if REFRESH_SECONDS > 0:
+    threading.Thread(target=refresh_loop, name="data-refresh", daemon=True).start()
 
-    # 1️⃣ RETAIL SHOPS UNDER DEPOT
-    retail_shops = wholesale[wholesale["from_entity_code"] == depotid]["to_entity_code"].unique()
 
-    if len(retail_shops) == 0:
-        return jsonify({"error": "No retail shops found for this depot"}), 404
+# Per-SKU Prophet fits run on a process pool capped by PROPHET_WORKERS;
+# fitted models are cached per (shops, SKU, training window, data version)
+executor = ForecastExecutor(cache=ModelCache())
 
-    # 2️⃣ FULL SALES DATA
-    depot_sales_full = retail[retail["entity_code"].isin(retail_shops)]
 
-    if depot_sales_full.empty:
-        return jsonify({"error": "No retail sales found for this depot"}), 404
+# Prophet is imported and the Stan model loaded in the background, so the
+# HTTP layer is up at once; /prophet/ready turns 200 when fits can start
+# without that cost, i.e. once the pool workers have been forked from it
+PRELOAD = os.getenv("PROPHET_PRELOAD", "1") != "0"
+backend_warm = threading.Event()
 
-    # Determine prediction year dynamically (using latest year in data)
-    year = depot_sales_full["bill_date"].dt.year.max()
 
-    # ---------------------------------------------------------
-    # 3️⃣ BUILD TRAINING WINDOW BASED ON from_month & months
-    # ---------------------------------------------------------
-    train_start_month = from_month - months
-    train_end_month = from_month - 1
+def preload_backend():
+    try:
+        forecasting.preload()
+        executor.warm()
+        backend_warm.set()
+    except Exception:
+        logging.exception("Forecast backend preload failed")
 
-    train_start_date = datetime(year, train_start_month, 1)
-    train_end_date = datetime(year, train_end_month, 1) + pd.offsets.MonthEnd(1)
 
-    # Filter training period
-    depot_sales_recent = depot_sales_full[
-        (depot_sales_full["bill_date"] >= train_start_date) &
-        (depot_sales_full["bill_date"] <= train_end_date)
-    ]
+if PRELOAD:
+    threading.Thread(target=preload_backend, name="backend-preload", daemon=True).start()
 
-    results = []
 
-    # ALL SKUs handled by depot
-    all_skus = depot_sales_full[["brand_name", "package_size"]].drop_duplicates().values.tolist()
+@app.route("/prophet/health", methods=["GET"])
+def health():
+    return jsonify({"status": "ok"})
 
-    # ---------------------------------------------------------
-    # 4️⃣ LOOP THROUGH ALL SKUs
-    # ---------------------------------------------------------
-    for brand, size in all_skus:
 
-        sku_recent = depot_sales_recent[
-            (depot_sales_recent["brand_name"] == brand) &
-            (depot_sales_recent["package_size"] == size)
-        ]
+@app.route("/prophet/ready", methods=["GET"])
+def ready():
+    # Without the preload thread the first fit loads Prophet (and forks
+    # the pool) itself
+    backend_ready = forecasting.ready.is_set() and (backend_warm.is_set() or not PRELOAD)
+    return jsonify({
+        "ready": backend_ready,
+        "backend_seconds": None if forecasting.preload_seconds is None
+        else round(forecasting.preload_seconds, 3),
+        "workers": executor.max_workers,
+        "data_version": data.version,
+        "snapshot_id": data.id,
+    }), 200 if backend_ready else 503
 
-        sku_df = (
-            sku_recent.groupby("bill_date")["sold_qty"]
-            .sum()
-            .reset_index()
-            .rename(columns={"bill_date": "ds", "sold_qty": "y"})
-        )
 
-        # CASE A: Enough data -> run Prophet
-        if len(sku_df) >= 5:
-            model = Prophet()
-            model.fit(sku_df)
+@app.route("/prophet/reload", methods=["POST"])
+def reload_data():
+    full = bool((request.get_json(silent=True) or {}).get("full", False))
+    snapshot = refresh_data(full)
+    return jsonify({
+        "version": snapshot.version,
+        "retail_rows": int(len(snapshot.retail)),
+        "depots": len(snapshot.hierarchy.depot_shops),
+        "distilleries": len(snapshot.hierarchy.distillery_depots)
+    })
 
-            # 5️⃣ FORECAST NEXT MONTH → from_month
-            predict_start = datetime(year, from_month, 1)
-            predict_end = predict_start + pd.offsets.MonthEnd(1)
 
-            future_dates = pd.date_range(start=predict_start, end=predict_end)
-            future = pd.DataFrame({"ds": future_dates})
+@app.route("/prophet/cache", methods=["GET"])
+def cache_stats():
+    return jsonify({**executor.cache.stats(), "fits": executor.stats()})
 
-            forecast = model.predict(future)
-            demand = float(forecast["yhat"].sum())
 
-        else:
-            # CASE B: No recent data -> demand = 0
-            demand = 0.0
-
-        # ---------------------------------------------------------
-        # REMAINING STOCK
-        # ---------------------------------------------------------
-        depot_stock = stock[
-            (stock["entity_code"] == depotid) &
-            (stock["brand_name"] == brand) &
-            (stock["package_size"] == size)
-        ]["closed_qty"].sum()
-
-        retail_stock_amt = stock[
-            (stock["entity_code"].isin(retail_shops)) &
-            (stock["brand_name"] == brand) &
-            (stock["package_size"] == size)
-        ]["closed_qty"].sum()
-
-        remaining_stock = int(depot_stock + retail_stock_amt)
-
-        # QUANTITY TO RAISE
-        qty_to_raise = max(demand - remaining_stock, 0)
-        quantitytoraise = int(round(qty_to_raise))
-        rounddemand = int(round(demand))
-
-        results.append({
-            "brand": str(brand),
-            "package_size": str(size),
-            "remaining_at_depot": int(depot_stock),
-             "remaining_at_retail": int(retail_stock_amt),
-            "demand": int(rounddemand),
-            "remaining_stock": remaining_stock,
-            "quantitytoraise": quantitytoraise
+# ---------------------------------------------------------
+# FORECAST ROUTES
+# ---------------------------------------------------------
+# "prophet" fits one model per SKU on the worker pool; the NumPy engines
+# forecast every SKU of a plan at once (see engines.py). "profile" picks
+# the Prophet configuration (forecasting.PROFILES)
+ENGINE_NAMES = ("prophet", *ENGINES)
+
+
+def forecast_plans(plans, engine, progress=None, budget=None):
+    """Forecast per predict month of every job of each plan, in plan order.
+
+    ``progress(done, total)`` counts SKU series of Prophet plans as their
+    fits finish (see ForecastExecutor.forecast_ranges); background work
+    passes its ``budget`` of pool workers (executor.FitBudget).
+    """
+    if engine != "prophet":
+        return [
+            [
+                totals
+                for part in plan.parts
+                for totals in matrix_range_totals(part.window, plan.train_start, plan.train_end,
+                                                  plan.predict_ranges, engine).tolist()
+            ]
+            for plan in plans
+        ]
+
+    # Every job of every plan goes to the executor in one call
+    job_totals = iter(executor.forecast_ranges(
+        [job for plan in plans for job in plan.jobs], progress, budget
+    ))
+    return [[next(job_totals) for _ in plan.jobs] for plan in plans]
+
+
+def request_error(engine, mode, horizon=None, profile=forecasting.DEFAULT_PROFILE):
+    if engine not in ENGINE_NAMES:
+        return f"engine must be one of {', '.join(ENGINE_NAMES)}"
+    if profile not in forecasting.PROFILES:
+        return f"profile must be one of {', '.join(forecasting.PROFILES)}"
+    if forecasting.PROFILES[profile]["intervals"] and engine != "prophet":
+        return f"profile {profile} needs the prophet engine"
+    if mode not in MODES:
+        return f"mode must be one of {', '.join(MODES)}"
+    if horizon is not None and (
+        not isinstance(horizon, int) or isinstance(horizon, bool)
+        or not 1 <= horizon <= MAX_HORIZON
+    ):
+        return f"horizon must be a number of months from 1 to {MAX_HORIZON}"
+    return None
+
+
+def run_scope(scope, scope_id, from_month, months, req):
+    engine = req.get("engine", "prophet")
+    mode = req.get("mode", "direct")
+    horizon = req.get("horizon")
+    profile = req.get("profile", forecasting.DEFAULT_PROFILE)
+    allocate = bool(req.get("allocate", False))
+
+    error = request_error(engine, mode, horizon, profile)
+    if error:
+        return jsonify({"error": error}), 400
+
+    stream = bool(req.get("stream", False))
+
+    snapshot = data
+    if not req.get("live", False) and horizon is None and not allocate:
+        rows = store.get(snapshot.id, {
+            "scope": scope, "id": scope_id, "from_month": from_month, "month": months,
+            "engine": engine, "mode": mode, "profile": profile
         })
+        if rows is not None:
+            return ndjson(iter(rows)) if stream else jsonify(rows)
+
+    try:
+        plan = PLANNERS[scope](snapshot, scope_id, from_month, months, mode, horizon, profile,
+                               allocate)
+    except ScopeError as e:
+        return jsonify({"error": e.message}), e.status
+
+    if stream:
+        return ndjson(stream_rows(plan, engine))
+
+    job_totals, = forecast_plans([plan], engine)
+    return jsonify(plan.results(job_totals))
+
+
+# ---------------------------------------------------------
+# STREAMING
+# ---------------------------------------------------------
+# "stream": true in a forecast body answers with one JSON line per SKU as
+# soon as its demand is known, instead of one array at the end
+def stream_rows(plan, engine):
+    if engine == "prophet":
+        job_totals = executor.forecast_iter(plan.jobs)
+    else:
+        job_totals = enumerate(forecast_plans([plan], engine)[0])
+
+    for index, demand, range_totals, part_demands in plan.sku_demands_iter(job_totals):
+        yield plan.row(index, demand, range_totals, part_demands)
+
+
+def ndjson(rows):
+    def lines():
+        try:
+            for row in rows:
+                yield json.dumps(row) + "\n"
+        except Exception as e:
+            # Headers are already sent; end the stream with an error line
+            logging.exception("Forecast stream failed")
+            yield json.dumps({"error": str(e)}) + "\n"
+
+    return Response(lines(), mimetype="application/x-ndjson")
+
+
+@app.route("/prophet/depot/predict", methods=["POST"])
+def predict():
+    req = request.json
+    months = req.get("month", 2)
+    from_month = req.get("from_month")    # NEW FIELD
+    depotid = str(req.get("id"))
+
+    if depotid is None:
+        return jsonify({"error": "depotid is required"}), 400
+
+    if from_month is None:
+        return jsonify({"error": "from_month is required"}), 400
+
+    return run_scope("depot", depotid, from_month, months, req)
 
-    return jsonify(results)
 
 @app.route("/prophet/distillery/predict", methods=["POST"])
 def predict_distillery():
@@ -163,148 +269,7 @@ def predict_distillery():
     if from_month is None:
         return jsonify({"error": "from_month is required"}), 400
 
-    # -----------------------------------------------------
-    # 1️⃣ FIND ALL DEPOTS UNDER THIS DISTILLERY
-    # -----------------------------------------------------
-    distillery_csv = pd.read_csv("data/poc_distillery.csv")
-    distillery_csv["from_entity_code"] = distillery_csv["from_entity_code"].astype(str)
-    distillery_csv["to_entity_code"] = distillery_csv["to_entity_code"].astype(str)
-
-    depots = distillery_csv[
-        distillery_csv["from_entity_code"] == distillery_id
-    ]["to_entity_code"].unique()
-
-    if len(depots) == 0:
-        return jsonify({"error": "No depots found under this distillery"}), 404
-
-    # -----------------------------------------------------
-    # 2️⃣ FIND RETAIL SHOPS UNDER THOSE DEPOTS
-    # -----------------------------------------------------
-    retail_shops = wholesale[
-        wholesale["from_entity_code"].isin(depots)
-    ]["to_entity_code"].unique()
-
-    # -----------------------------------------------------
-    # 3️⃣ SALES OF THOSE RETAIL SHOPS
-    # -----------------------------------------------------
-    dist_sales_full = retail[
-        retail["entity_code"].isin(retail_shops)
-    ]
-
-    if dist_sales_full.empty:
-        return jsonify({"error": "No retail sales found for this distillery"}), 404
-
-    year = dist_sales_full["bill_date"].dt.year.max()
-
-    # -----------------------------------------------------
-    # 4️⃣ DEFINE TRAINING WINDOW
-    # -----------------------------------------------------
-    train_start_month = from_month - months
-    train_end_month = from_month - 1
-
-    train_start = datetime(year, train_start_month, 1)
-    train_end = datetime(year, train_end_month, 1) + pd.offsets.MonthEnd(1)
-
-    dist_sales_recent = dist_sales_full[
-        (dist_sales_full["bill_date"] >= train_start) &
-        (dist_sales_full["bill_date"] <= train_end)
-    ]
-
-    # ALL SKUs produced by this distillery (via depots)
-    all_skus = dist_sales_full[["brand_name", "package_size"]].drop_duplicates().values.tolist()
-
-    results = []
-
-    # -----------------------------------------------------
-    # 5️⃣ PROCESS EACH SKU
-    # -----------------------------------------------------
-    for brand, size in all_skus:
-
-        sku_recent = dist_sales_recent[
-            (dist_sales_recent["brand_name"] == brand) &
-            (dist_sales_recent["package_size"] == size)
-        ]
-
-        sku_df = (
-            sku_recent.groupby("bill_date")["sold_qty"]
-            .sum().reset_index()
-            .rename(columns={"bill_date": "ds", "sold_qty": "y"})
-        )
-
-        # Forecast demand
-        if len(sku_df) >= 5:
-            model = Prophet()
-            model.fit(sku_df)
-
-            total_demand = 0
-            predict_year = year
-            predict_month = from_month
-        
-            for _ in range(2):   # 2 months
-                start = datetime(predict_year, predict_month, 1)
-                end = start + pd.offsets.MonthEnd(1)
-        
-                future_dates = pd.date_range(start, end)
-                forecast = model.predict(pd.DataFrame({"ds": future_dates}))
-        
-                # Add this month's predicted total
-                total_demand += float(forecast["yhat"].sum())
-        
-                # Move to next month
-                predict_month += 1
-                if predict_month > 12:
-                    predict_month = 1
-                    predict_year += 1
-
-            demand = total_demand
-        else:
-            demand = 0.0
-        
-        # -----------------------------------------------------
-        # STOCK CALCULATIONS
-        # -----------------------------------------------------
-
-        # Distillery stock
-        remaining_at_distillery = int(stock[
-            (stock["entity_code"] == distillery_id) &
-            (stock["brand_name"] == brand) &
-            (stock["package_size"] == size)
-        ]["closed_qty"].sum())
-
-        # Depot stock (all depots under distillery)
-        remaining_at_depot = int(stock[
-            (stock["entity_code"].isin(depots)) &
-            (stock["brand_name"] == brand) &
-            (stock["package_size"] == size)
-        ]["closed_qty"].sum())
-
-        # Retail stock under those depots
-        remaining_at_retail = int(stock[
-            (stock["entity_code"].isin(retail_shops)) &
-            (stock["brand_name"] == brand) &
-            (stock["package_size"] == size)
-        ]["closed_qty"].sum())
-
-        remaining_stock = (
-            remaining_at_distillery +
-            remaining_at_depot +
-            remaining_at_retail
-        )
-
-        quantitytoraise = int(round(max(demand - remaining_stock, 0)))
-
-        results.append({
-            "brand": str(brand),
-            "package_size": str(size),
-            "demand": int(round(demand)),
-            "remaining_at_distillery": remaining_at_distillery,
-            "remaining_at_depot": remaining_at_depot,
-            "remaining_at_retail": remaining_at_retail,
-            "remaining_stock": remaining_stock,
-            "quantityToManufacture": quantitytoraise
-        })
-
-    return jsonify(results)
+    return run_scope("distillery", distillery_id, from_month, months, req)
 
 
 @app.route("/prophet/intent", methods=["POST"])
@@ -320,135 +285,290 @@ def predict_intent():
     if from_month is None:
         return jsonify({"error": "from_month is required"}), 400
 
-    # -----------------------------------------------------
-    # 1️⃣ FIND ALL DEPOTS UNDER THIS DISTILLERY
-    # -----------------------------------------------------
-    distillery_csv = pd.read_csv("data/poc_distillery.csv")
-    distillery_csv["from_entity_code"] = distillery_csv["from_entity_code"].astype(str)
-    distillery_csv["to_entity_code"] = distillery_csv["to_entity_code"].astype(str)
-
-    depots = distillery_csv[
-        distillery_csv["from_entity_code"] == distillery_id
-    ]["to_entity_code"].unique()
-
-    if len(depots) == 0:
-        return jsonify({"error": "No depots found under this distillery"}), 404
-
-    # -----------------------------------------------------
-    # 2️⃣ FIND RETAIL SHOPS UNDER THOSE DEPOTS
-    # -----------------------------------------------------
-    retail_shops = wholesale[
-        wholesale["from_entity_code"].isin(depots)
-    ]["to_entity_code"].unique()
-
-    # -----------------------------------------------------
-    # 3️⃣ SALES OF THOSE RETAIL SHOPS
-    # -----------------------------------------------------
-    dist_sales_full = retail[
-        retail["entity_code"].isin(retail_shops)
-    ]
-
-    if dist_sales_full.empty:
-        return jsonify({"error": "No retail sales found for this distillery"}), 404
-
-    year = dist_sales_full["bill_date"].dt.year.max()
-
-    # -----------------------------------------------------
-    # 4️⃣ DEFINE TRAINING WINDOW
-    # -----------------------------------------------------
-    train_start_month = from_month - months
-    train_end_month = from_month - 1
-
-    train_start = datetime(year, train_start_month, 1)
-    train_end = datetime(year, train_end_month, 1) + pd.offsets.MonthEnd(1)
-
-    dist_sales_recent = dist_sales_full[
-        (dist_sales_full["bill_date"] >= train_start) &
-        (dist_sales_full["bill_date"] <= train_end)
-    ]
-
-    # ALL SKUs produced by this distillery (via depots)
-    all_skus = dist_sales_full[["brand_name", "package_size"]].drop_duplicates().values.tolist()
-
-    results = []
-
-    # -----------------------------------------------------
-    # 5️⃣ PROCESS EACH SKU
-    # -----------------------------------------------------
-    for brand, size in all_skus:
-
-        sku_recent = dist_sales_recent[
-            (dist_sales_recent["brand_name"] == brand) &
-            (dist_sales_recent["package_size"] == size)
-        ]
+    return run_scope("intent", distillery_id, from_month, months, req)
+
 
-        sku_df = (
-            sku_recent.groupby("bill_date")["sold_qty"]
-            .sum().reset_index()
-            .rename(columns={"bill_date": "ds", "sold_qty": "y"})
-        )
+# ---------------------------------------------------------
+# BATCH
+# ---------------------------------------------------------
+BATCH_MAX_ITEMS = int(os.getenv("PROPHET_BATCH_MAX_ITEMS", "500"))
+
+
+def expand_batch(requests):
+    """One item per (scope, id, from_month); "ids" / "from_months" lists
+    expand to every combination."""
+    items = []
+    for req in requests:
+        ids = req.get("ids", [req.get("id")])
+        from_months = req.get("from_months", [req.get("from_month")])
+        for scope_id in ids:
+            for from_month in from_months:
+                items.append({
+                    "scope": req.get("scope"),
+                    "id": None if scope_id is None else str(scope_id),
+                    "from_month": from_month,
+                    "month": req.get("month", 2),
+                    "engine": req.get("engine", "prophet"),
+                    "mode": req.get("mode", "direct"),
+                    "horizon": req.get("horizon"),
+                    "profile": req.get("profile", forecasting.DEFAULT_PROFILE),
+                    "allocate": bool(req.get("allocate", False))
+                })
+    return items
+
+
+def plan_items(snapshot, items):
+    """Plan per batch item; None (with "error" / "status" set on the item)
+    for items that cannot be forecast."""
+    plans = []
+    for item in items:
+        plan = None
+        if item["scope"] not in PLANNERS:
+            item["error"], item["status"] = "scope must be one of depot, distillery, intent", 400
+        elif request_error(item["engine"], item["mode"], item["horizon"], item["profile"]):
+            item["error"], item["status"] = request_error(
+                item["engine"], item["mode"], item["horizon"], item["profile"]
+            ), 400
+        elif item["id"] is None:
+            item["error"], item["status"] = "id is required", 400
+        elif item["from_month"] is None:
+            item["error"], item["status"] = "from_month is required", 400
+        else:
+            try:
+                plan = PLANNERS[item["scope"]](
+                    snapshot, item["id"], item["from_month"], item["month"], item["mode"],
+                    item["horizon"], item["profile"], item["allocate"]
+                )
+            except ScopeError as e:
+                item["error"], item["status"] = e.message, e.status
+            except ValueError as e:
+                # e.g. a training window that starts before January
+                item["error"], item["status"] = str(e), 400
+        plans.append(plan)
+    return plans
+
+
+def forecast_items(items, plans, progress=None, budget=None):
+    """Fill in "results" of every planned item; ``progress(done, total)``
+    counts SKU series over all items."""
+    total = sum(len(plan.jobs) for plan in plans if plan is not None)
+    done = 0
+
+    # One forecast call per engine covering all of its items
+    for engine in ENGINE_NAMES:
+        batch = [(item, plan) for item, plan in zip(items, plans)
+                 if plan is not None and item["engine"] == engine]
+        if not batch:
+            continue
+
+        engine_progress = None
+        if progress is not None:
+            engine_progress = lambda n, _, base=done: progress(base + n, total)
+
+        job_totals = forecast_plans([plan for _, plan in batch], engine, engine_progress,
+                                    budget)
+        for (item, plan), plan_totals in zip(batch, job_totals):
+            item["results"] = plan.results(plan_totals)
+
+        done += sum(len(plan.jobs) for _, plan in batch)
+        if progress is not None:
+            progress(done, total)
+    return items
+
+
+@app.route("/prophet/batch/predict", methods=["POST"])
+def predict_batch():
+    """Forecasts many depot / distillery / intent scopes in one call.
+
+    Body: {"requests": [{"scope": "depot", "ids": [...], "from_months": [...],
+    "month": 2, "engine": "prophet", "mode": "direct", "horizon": 3,
+    "profile": "fast", "allocate": true}, ...]} ("id" / "from_month" also
+    accepted; "horizon", "profile" and "allocate" are optional). Series
+    shared by several items are fitted once and all fits are scheduled
+    together.
+    """
+    req = request.json or {}
+    items = expand_batch(req.get("requests", []))
+
+    if not items:
+        return jsonify({"error": "requests is required"}), 400
+
+    if len(items) > BATCH_MAX_ITEMS:
+        return jsonify({"error": f"at most {BATCH_MAX_ITEMS} forecasts per batch"}), 400
+
+    plans = plan_items(data, items)
+    return jsonify({"results": forecast_items(items, plans)})
 
-        # Forecast demand
-        if len(sku_df) >= 5:
-            model = Prophet()
-            model.fit(sku_df)
 
-            predict_start = datetime(year, from_month, 1)
-            predict_end = predict_start + pd.offsets.MonthEnd(1)
+# ---------------------------------------------------------
+# JOBS
+# ---------------------------------------------------------
+# Jobs with more Prophet series than this go to the "long" lane, whose
+# fits stay within executor.background so short jobs and the synchronous
+# routes always find a free worker
+SHORT_JOB_FITS = int(os.getenv("PROPHET_JOB_SHORT_FITS", "20"))
 
-            future_dates = pd.date_range(predict_start, predict_end)
-            forecast = model.predict(pd.DataFrame({"ds": future_dates}))
+jobs = JobQueue()
+
+
+@app.route("/prophet/jobs", methods=["POST"])
+def submit_job():
+    """Queues a forecast and returns its job id at once (202).
+
+    Body: one batch request ({"scope": "distillery", "id": ..., "from_month":
+    ..., ...}) or {"requests": [...]} as for /prophet/batch/predict. Poll
+    GET /prophet/jobs/<job_id> for progress and fetch the batch-shaped
+    response from GET /prophet/jobs/<job_id>/result.
+    """
+    req = request.json or {}
+    items = expand_batch(req.get("requests", [req]))
+
+    if not items:
+        return jsonify({"error": "requests is required"}), 400
+
+    if len(items) > BATCH_MAX_ITEMS:
+        return jsonify({"error": f"at most {BATCH_MAX_ITEMS} forecasts per job"}), 400
+
+    plans = plan_items(data, items)
+    fits = sum(
+        len(plan.jobs) for item, plan in zip(items, plans)
+        if plan is not None and item["engine"] == "prophet"
+    )
+    lane = "long" if fits > SHORT_JOB_FITS else "short"
+    budget = executor.background if lane == "long" else None
+
+    def run(job):
+        return {"results": forecast_items(items, plans, job.progress, budget)}
+
+    total = sum(len(plan.jobs) for plan in plans if plan is not None)
+    try:
+        job = jobs.submit(lane, run, total, items=len(items))
+    except queue.Full:
+        return jsonify({"error": f"{lane} job queue is full, retry later"}), 503
+
+    return jsonify(job.to_dict()), 202
+
+
+@app.route("/prophet/jobs", methods=["GET"])
+def job_stats():
+    return jsonify(jobs.stats())
+
+
+@app.route("/prophet/jobs/<job_id>", methods=["GET"])
+def job_status(job_id):
+    job = jobs.get(job_id)
+    if job is None:
+        return jsonify({"error": "job not found"}), 404
+    return jsonify(job.to_dict())
+
+
+@app.route("/prophet/jobs/<job_id>/result", methods=["GET"])
+def job_result(job_id):
+    job = jobs.get(job_id)
+    if job is None:
+        return jsonify({"error": "job not found"}), 404
+    if job.status == "failed":
+        return jsonify({"error": job.error}), 500
+    if job.status != "done":
+        return jsonify(job.to_dict()), 202
+    return jsonify(job.result)
+
+
+# ---------------------------------------------------------
+# BACKTEST
+# ---------------------------------------------------------
+@app.route("/prophet/backtest", methods=["POST"])
+def submit_backtest():
+    """Queues a rolling-origin backtest of one scope (see backtest.py).
+
+    Body: {"scope": "depot", "id": ..., "months": [1, 2, 3], "engines":
+    ["prophet", "holt_winters"], "mode": "direct"}; all but scope and id are
+    optional. Returns 202 with a job id; the report is the job's result.
+    """
+    req = request.json or {}
+    scope = req.get("scope")
+    scope_id = req.get("id")
+    windows = req.get("months", [2])
+    engines = req.get("engines", list(ENGINE_NAMES))
+    mode = req.get("mode", "direct")
+
+    if isinstance(windows, int):
+        windows = [windows]
+
+    if scope not in PLANNERS:
+        return jsonify({"error": "scope must be one of depot, distillery, intent"}), 400
+    if scope_id is None:
+        return jsonify({"error": "id is required"}), 400
+    if not windows or not all(isinstance(m, int) and 1 <= m <= 11 for m in windows):
+        return jsonify({"error": "months must be training windows from 1 to 11"}), 400
+    for engine in engines or [None]:
+        error = request_error(engine, mode)
+        if error:
+            return jsonify({"error": error}), 400
+
+    snapshot = data
+
+    def run(job):
+        return backtest(snapshot, executor, scope, str(scope_id), windows, engines, mode,
+                        job.progress, executor.background)
+
+    try:
+        job = jobs.submit("long", run, backtest=scope)
+    except queue.Full:
+        return jsonify({"error": "long job queue is full, retry later"}), 503
+    return jsonify(job.to_dict()), 202
+
+
+# ---------------------------------------------------------
+# MATERIALIZED FORECASTS
+# ---------------------------------------------------------
+# Coming-month forecasts of every scope, recomputed after each refresh and
+# served by the forecast routes unless the body has "live": true. The
+# recompute is a low-priority job: its own lane, and fewer fits in flight
+# than long jobs may have
+store = ForecastStore()
+materialize_budget = FitBudget(MATERIALIZE_FITS, executor.background)
+
+
+def schedule_materialize(snapshot):
+    items = materialize_items(snapshot)
+    if not items:
+        return None
+    plans = plan_items(snapshot, items)
+
+    def run(job):
+        started = time.perf_counter()
+        forecast_items(items, plans, job.progress, materialize_budget)
+        store.replace(snapshot.id, items, time.perf_counter() - started)
+        return {"version": snapshot.id, "items": len(items)}
+
+    total = sum(len(plan.jobs) for plan in plans if plan is not None)
+    try:
+        return jobs.submit("background", run, total, items=len(items),
+                           materialize=snapshot.id)
+    except queue.Full:
+        logging.warning("Job queue full, forecasts for %s not materialized", snapshot.id)
+        return None
+
+
+@app.route("/prophet/materialize", methods=["POST"])
+def rematerialize():
+    job = schedule_materialize(data)
+    if job is None:
+        return jsonify({"error": "nothing to materialize or job queue is full"}), 503
+    return jsonify(job.to_dict()), 202
+
+
+@app.route("/prophet/materialized", methods=["GET"])
+def materialized_stats():
+    return jsonify(store.stats())
 
-            demand = float(forecast["yhat"].sum())
-        else:
-            demand = 0.0
-
-        # -----------------------------------------------------
-        # STOCK CALCULATIONS
-        # -----------------------------------------------------
-
-        # Distillery stock
-        remaining_at_distillery = int(stock[
-            (stock["entity_code"] == distillery_id) &
-            (stock["brand_name"] == brand) &
-            (stock["package_size"] == size)
-        ]["closed_qty"].sum())
-
-        # Depot stock (all depots under distillery)
-        remaining_at_depot = int(stock[
-            (stock["entity_code"].isin(depots)) &
-            (stock["brand_name"] == brand) &
-            (stock["package_size"] == size)
-        ]["closed_qty"].sum())
-
-        # Retail stock under those depots
-        remaining_at_retail = int(stock[
-            (stock["entity_code"].isin(retail_shops)) &
-            (stock["brand_name"] == brand) &
-            (stock["package_size"] == size)
-        ]["closed_qty"].sum())
-
-        remaining_stock = (
-            remaining_at_distillery +
-            remaining_at_depot +
-            remaining_at_retail
-        )
-
-        quantitytoraise = int(round(max(demand - remaining_stock, 0)))
-
-        results.append({
-            "brand": str(brand),
-            "package_size": str(size),
-            "demand": int(round(demand)),
-            "remaining_at_distillery": remaining_at_distillery,
-            "remaining_at_depot": remaining_at_depot,
-            "remaining_at_retail": remaining_at_retail,
-            "remaining_stock": remaining_stock,
-            "quantitytoraise": quantitytoraise
-        })
 
-    return jsonify(results)
+if MATERIALIZE_ENABLED and store.version != data.id:
+    schedule_materialize(data)
 
 
 if __name__ == "__main__":
-    app.run(host="0.0.0.0", port=5001, debug=True)
+    # No reloader: it imports this module twice, and each copy would fork a
+    # pool, preload and materialize on its own
+    app.run(host="0.0.0.0", port=5001, debug=True, use_reloader=False)
@@ -0,0 +1,152 @@
+"""Rolling-origin backtest of one scope: accuracy per SKU, engine and window.
+
+Every month that has complete sales data and at least the longest
+training window before it is a cutoff. For each cutoff, training window
+and engine the scope is planned exactly as the forecast routes do (one
+month ahead) and every SKU's forecast is scored against actual retail
+sales of the plan's shops. All Prophet fits of all cutoffs and windows go
+to the executor in one call, so they run in parallel on the worker pool.
+
+    python backtest.py --scope depot --id DEPOVIZ001 --months 1 2 3
+
+POST /prophet/backtest runs the same as a background job. SKU-months with
+fewer than MIN_POINTS training days are skipped since every engine
+returns 0 for them.
+"""
+import argparse
+import json
+import time
+
+import numpy as np
+
+from compare_engines import evaluation_months, scope_shops, score
+from engines import ENGINES, matrix_range_totals
+from forecasting import MIN_POINTS, total_demand
+from scopes import MODES, PLANNERS, ScopeError
+
+
+def actual_sales(snapshot, plan):
+    """Sales per SKU over the plan's shops and predict ranges."""
+    actual = np.zeros(len(plan.skus))
+    for part in plan.parts:
+        positions = snapshot.sales.positions(part.shops)
+        for start, end in plan.predict_ranges:
+            window = snapshot.sales.window(positions, plan.skus, start, end)
+            actual += np.nansum(window.totals, axis=1)
+    return actual
+
+
+def backtest(snapshot, executor, scope, scope_id, windows=(2,), engines=("prophet", *ENGINES),
+             mode="direct", progress=None, budget=None):
+    if scope not in PLANNERS:
+        raise ScopeError(f"scope must be one of {', '.join(PLANNERS)}", 400)
+
+    shops = scope_shops(snapshot, scope, scope_id)
+    cutoffs = evaluation_months(snapshot, shops, max(windows)) if shops else []
+    if not cutoffs:
+        raise ScopeError("No month with complete sales and a full training window before it")
+
+    started = time.perf_counter()
+
+    # (window, cutoff, plan, actual per SKU, SKUs with enough training days)
+    cases = []
+    for months in windows:
+        for from_month in cutoffs:
+            plan = PLANNERS[scope](snapshot, scope_id, from_month, months, mode, 1)
+            fitted = np.zeros(len(plan.skus), dtype=bool)
+            for part in plan.parts:
+                fitted |= np.array([len(sku_df) >= MIN_POINTS for sku_df in part.series])
+            cases.append((months, from_month, plan, actual_sales(snapshot, plan), fitted))
+
+    report = {"scope": scope, "id": scope_id, "mode": mode, "cutoffs": cutoffs, "engines": {}}
+
+    for engine in engines:
+        engine_started = time.perf_counter()
+        if engine == "prophet":
+            job_totals = iter(executor.forecast_ranges(
+                [job for *_, plan, _, _ in cases for job in plan.jobs], progress, budget
+            ))
+            per_case = [[next(job_totals) for _ in plan.jobs] for *_, plan, _, _ in cases]
+        else:
+            per_case = [
+                [totals for part in plan.parts
+                 for totals in matrix_range_totals(part.window, plan.train_start, plan.train_end,
+                                                   plan.predict_ranges, engine).tolist()]
+                for *_, plan, _, _ in cases
+            ]
+
+        by_window = {}
+        for (months, from_month, plan, actual, fitted), job_totals in zip(cases, per_case):
+            part_totals = plan.part_demands(job_totals)
+            demands = plan.sku_demands([
+                [total_demand(totals) for totals in part] for part in part_totals
+            ])
+            skus = by_window.setdefault(months, {})
+            for sku, demand, sku_actual, ok in zip(plan.skus, demands, actual, fitted):
+                if ok:
+                    forecasts, actuals = skus.setdefault(sku, ([], []))
+                    forecasts.append(demand)
+                    actuals.append(float(sku_actual))
+
+        report["engines"][engine] = {
+            "seconds": round(time.perf_counter() - engine_started, 3),
+            "windows": {
+                str(months): {
+                    **score(
+                        [f for forecasts, _ in skus.values() for f in forecasts],
+                        [a for _, actuals in skus.values() for a in actuals],
+                    ),
+                    "skus": [
+                        {"brand": str(brand), "package_size": str(size),
+                         **score(forecasts, actuals)}
+                        for (brand, size), (forecasts, actuals) in skus.items()
+                    ],
+                }
+                for months, skus in by_window.items()
+            },
+        }
+
+    report["seconds"] = round(time.perf_counter() - started, 3)
+    return report
+
+
+def main():
+    from datastore import load_snapshot
+    from executor import ForecastExecutor
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--scope", choices=list(PLANNERS), required=True)
+    parser.add_argument("--id", required=True)
+    parser.add_argument("--months", type=int, nargs="+", default=[2],
+                        help="training windows in months")
+    parser.add_argument("--engines", nargs="+", default=["prophet", *ENGINES],
+                        choices=["prophet", *ENGINES])
+    parser.add_argument("--mode", choices=MODES, default="direct")
+    parser.add_argument("--json", help="also write the report to this file")
+    args = parser.parse_args()
+
+    executor = ForecastExecutor()
+    try:
+        report = backtest(load_snapshot(), executor, args.scope, args.id,
+                          args.months, args.engines, args.mode)
+    except ScopeError as e:
+        parser.exit(1, f"{e.message}\n")
+    finally:
+        executor.shutdown()
+
+    print(f"{args.scope} {args.id}: cutoffs {report['cutoffs']}, {report['seconds']}s")
+    print(f"{'engine':<16}{'window':>8}{'MAPE':>10}{'bias':>10}{'SKU-months':>12}{'seconds':>10}")
+    for engine, result in report["engines"].items():
+        for months, row in result["windows"].items():
+            mape = "-" if row["mape"] is None else f"{row['mape']:.1%}"
+            bias = "-" if row["bias"] is None else f"{row['bias']:+.1%}"
+            print(f"{engine:<16}{months:>8}{mape:>10}{bias:>10}{row['sku_months']:>12}"
+                  f"{result['seconds']:>10}")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,228 @@
+"""Latency, peak memory and fit throughput of the forecast endpoints.
+
+    python benchmark.py --shops 1000 --skus 100 --json bench.json
+    python benchmark.py ... --compare bench.json    # against an earlier run
+
+Generates synthetic tables (synthetic.py, same scale arguments and seed)
+unless --data-dir is given, points the service at them and calls each
+endpoint through the Flask test client: once with an empty model cache
+("cold") and once more with the models of that run cached ("warm").
+Peak memory after each step is the sum of each process's own peak RSS
+(VmHWM): this process plus its live pool workers, where the Prophet fits
+run. Since the processes peak at different times, it is an upper bound
+on their combined peak. Without /proc it falls back to getrusage, which
+only counts this process and the largest finished child.
+The JSON report records the git commit, scale and environment so that
+runs on different commits with the same arguments can be compared.
+"""
+import argparse
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+import synthetic
+
+
+def child_pids(pid):
+    children = []
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as f:
+                # The fields after the ")" ending the command name
+                fields = f.read().rsplit(")", 1)[1].split()
+        except OSError:
+            continue            # exited meanwhile
+        if int(fields[1]) == pid:
+            children.append(int(entry))
+    return children
+
+
+def vm_hwm_kb(pid):
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return 0
+
+
+def peak_rss_mb():
+    if not os.path.isdir("/proc/self"):
+        own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+        return round((own + children) / 1024, 1)      # KB on Linux
+
+    pid = os.getpid()
+    return round(sum(vm_hwm_kb(p) for p in [pid, *child_pids(pid)]) / 1024, 1)
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)), check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def scenarios(snapshot, months):
+    """(name, path, body) of every measured request."""
+    depot = next(iter(snapshot.hierarchy.depot_shops))
+    distillery = next(iter(snapshot.hierarchy.distillery_depots))
+    # Forecast the last month in the data from the months before it
+    from_month = snapshot.sales.dates[-1].month
+    base = {"from_month": from_month, "month": months, "live": True}
+
+    return [
+        ("depot", "/prophet/depot/predict", {**base, "id": depot}),
+        ("distillery", "/prophet/distillery/predict", {**base, "id": distillery}),
+        ("intent", "/prophet/intent", {**base, "id": distillery}),
+        ("distillery_hierarchical", "/prophet/distillery/predict",
+         {**base, "id": distillery, "mode": "hierarchical"}),
+        ("distillery_holt_winters", "/prophet/distillery/predict",
+         {**base, "id": distillery, "engine": "holt_winters"}),
+        ("distillery_seasonal_naive", "/prophet/distillery/predict",
+         {**base, "id": distillery, "engine": "seasonal_naive"}),
+        ("batch_all_depots", "/prophet/batch/predict", {"requests": [{
+            "scope": "depot", "ids": list(snapshot.hierarchy.depot_shops),
+            "from_month": from_month, "month": months,
+        }]}),
+    ]
+
+
+def measure(client, executor, path, body):
+    before = executor.stats()
+    started = time.perf_counter()
+    response = client.post(path, json=body)
+    seconds = time.perf_counter() - started
+    after = executor.stats()
+
+    if response.status_code != 200:
+        raise RuntimeError(f"{path} returned {response.status_code}: {response.get_json()}")
+
+    fits = sum(after[kind]["fits"] - before[kind]["fits"] for kind in ("cold", "warm"))
+    return {
+        "seconds": round(seconds, 4),
+        "fits": fits,
+        "fits_per_second": round(fits / seconds, 2) if fits else None,
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+
+def run(args):
+    data_dir = args.data_dir or tempfile.mkdtemp(prefix="prophet-bench-")
+
+    # The service modules read their configuration at import time
+    os.environ.update({
+        "PROPHET_DATA_SOURCE": "csv",
+        "PROPHET_DATA_DIR": data_dir,
+        "PROPHET_MATERIALIZE": "0",
+        "PROPHET_REFRESH_SECONDS": "0",
+    })
+    os.environ.pop("PROPHET_MODEL_CACHE_DIR", None)
+
+    generate_seconds = None
+    if args.data_dir is None:
+        started = time.perf_counter()
+        synthetic.write_tables(synthetic.make_tables(**synthetic.scale(args)), data_dir)
+        generate_seconds = round(time.perf_counter() - started, 3)
+
+    started = time.perf_counter()
+    import app
+    from model_cache import ModelCache
+    load_seconds = time.perf_counter() - started
+
+    snapshot = app.data
+    client = app.app.test_client()
+    report = {
+        "commit": git_commit(),
+        "scale": synthetic.scale(args) if args.data_dir is None else {"data_dir": data_dir},
+        "months": args.months,
+        "environment": {
+            "python": platform.python_version(),
+            "cpus": os.cpu_count(),
+            "workers": app.executor.max_workers,
+        },
+        "data": {
+            "retail_rows": int(len(snapshot.retail)),
+            "shops": len(snapshot.sales.entities),
+            "skus": len(snapshot.sales.skus),
+            "depots": len(snapshot.hierarchy.depot_shops),
+            "distilleries": len(snapshot.hierarchy.distillery_depots),
+        },
+        "generate_seconds": generate_seconds,
+        "startup": {"seconds": round(load_seconds, 3), "peak_rss_mb": peak_rss_mb()},
+        "endpoints": {},
+    }
+
+    started = time.perf_counter()
+    client.post("/prophet/reload", json={"full": True})
+    report["reload"] = {"seconds": round(time.perf_counter() - started, 3),
+                        "peak_rss_mb": peak_rss_mb()}
+
+    for name, path, body in scenarios(snapshot, args.months):
+        app.executor.cache = ModelCache(cache_dir=None)
+        report["endpoints"][name] = {
+            "cold": measure(client, app.executor, path, body),
+            "warm": measure(client, app.executor, path, body),
+        }
+        print(f"  {name} done", file=sys.stderr)
+
+    app.executor.shutdown()
+    return report
+
+
+def print_report(report, baseline=None):
+    print(f"commit {report['commit']}  {report['data']}")
+    print(f"startup {report['startup']['seconds']}s  reload {report['reload']['seconds']}s  "
+          f"peak RSS {report['reload']['peak_rss_mb']} MB")
+
+    header = f"{'endpoint':<28}{'cold s':>10}{'warm s':>10}{'fits':>8}{'fits/s':>10}{'RSS MB':>10}"
+    if baseline:
+        header += f"{'vs base':>10}"
+    print(header)
+
+    for name, row in report["endpoints"].items():
+        cold, warm = row["cold"], row["warm"]
+        line = (f"{name:<28}{cold['seconds']:>10}{warm['seconds']:>10}{cold['fits']:>8}"
+                f"{cold['fits_per_second'] or '-':>10}{cold['peak_rss_mb']:>10}")
+        base = (baseline or {}).get("endpoints", {}).get(name)
+        if base:
+            line += f"{cold['seconds'] / base['cold']['seconds']:>9.2f}x"
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    synthetic.add_arguments(parser)
+    parser.add_argument("--data-dir", help="benchmark these CSV files instead of synthetic ones")
+    parser.add_argument("--months", type=int, default=2, help="training window in months")
+    parser.add_argument("--json", help="write the report to this file")
+    parser.add_argument("--compare", help="earlier --json report to compare cold latency with")
+    args = parser.parse_args()
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+
+    report = run(args)
+    print_report(report, baseline)
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
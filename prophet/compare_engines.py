@@ -0,0 +1,125 @@
+"""Accuracy / speed report: Prophet vs the NumPy engines.
+
+For every depot and distillery, and every month that has a full training
+window before it and complete sales data, each engine forecasts that
+month from the preceding ``--months`` months (exactly as the forecast
+routes do) and is scored against the actual retail sales:
+
+    python compare_engines.py --months 2 [--json report.json]
+
+MAPE is averaged over SKU-months with non-zero actual sales; bias is
+sum(forecast - actual) / sum(actual). SKU-months below MIN_POINTS training
+days are skipped since every engine returns 0 for them.
+"""
+import argparse
+import json
+import time
+
+import numpy as np
+import pandas as pd
+
+from datastore import load_snapshot
+from engines import ENGINES, matrix_demands
+from executor import ForecastExecutor
+from forecasting import MIN_POINTS
+from scopes import PLANNERS, ScopeError
+
+
+def scope_shops(snapshot, scope, scope_id):
+    if scope == "depot":
+        return snapshot.hierarchy.shops_for_depot(scope_id)
+    return snapshot.hierarchy.shops_for_distillery(scope_id)
+
+
+def evaluation_months(snapshot, shops, months):
+    """from_month values whose training window and target month are in the data."""
+    sales = snapshot.sales
+    positions = sales.positions(shops)
+    first, last = sales.dates[0], sales.last_date(positions)
+    last_full = last.month if (last + pd.Timedelta(days=1)).day == 1 else last.month - 1
+    return [
+        m for m in range(1, last_full + 1)
+        if m - months >= 1 and pd.Timestamp(last.year, m - months, 1) >= first
+    ]
+
+
+def collect_cases(snapshot, months):
+    """(plan, actual monthly sales per SKU) for every scope and month."""
+    cases = []
+    scopes = [("depot", d) for d in snapshot.hierarchy.depot_shops] + \
+             [("intent", d) for d in snapshot.hierarchy.distillery_depots]
+
+    for scope, scope_id in scopes:
+        shops = scope_shops(snapshot, scope, scope_id)
+        for from_month in evaluation_months(snapshot, shops, months):
+            try:
+                plan = PLANNERS[scope](snapshot, scope_id, from_month, months)
+            except ScopeError:
+                continue
+            (start, end), = plan.predict_ranges
+            actual = snapshot.sales.window(snapshot.sales.positions(shops), plan.skus, start, end)
+            cases.append((scope, scope_id, from_month, plan, np.nansum(actual.totals, axis=1)))
+    return cases
+
+
+def score(forecast, actual):
+    forecast, actual = np.asarray(forecast), np.asarray(actual)
+    nonzero = actual > 0
+    return {
+        "mape": float(np.mean(np.abs(forecast[nonzero] - actual[nonzero]) / actual[nonzero]))
+        if nonzero.any() else None,
+        "bias": float((forecast - actual).sum() / actual.sum()) if actual.sum() else None,
+        "sku_months": int(len(actual)),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--months", type=int, default=2, help="training window in months")
+    parser.add_argument("--json", help="also write the report to this file")
+    args = parser.parse_args()
+
+    snapshot = load_snapshot()
+    cases = collect_cases(snapshot, args.months)
+    executor = ForecastExecutor()
+
+    report = {}
+    for engine in ("prophet", *ENGINES):
+        forecasts, actuals = [], []
+        started = time.perf_counter()
+
+        if engine == "prophet":
+            jobs = [job for *_, plan, _ in cases for job in plan.jobs]
+            demands = iter(executor.forecast(jobs))
+            per_case = [[next(demands) for _ in plan.jobs] for *_, plan, _ in cases]
+        else:
+            per_case = [
+                matrix_demands(plan.parts[0].window, plan.train_start, plan.train_end,
+                               plan.predict_ranges, engine)
+                for *_, plan, _ in cases
+            ]
+        elapsed = time.perf_counter() - started
+
+        for (*_, plan, actual), demands in zip(cases, per_case):
+            fitted = [len(sku_df) >= MIN_POINTS for sku_df in plan.parts[0].series]
+            forecasts += [d for d, ok in zip(demands, fitted) if ok]
+            actuals += [a for a, ok in zip(actual, fitted) if ok]
+
+        report[engine] = {**score(forecasts, actuals), "seconds": round(elapsed, 3)}
+
+    executor.shutdown()
+
+    print(f"{len(cases)} scope-months, training window {args.months} months")
+    print(f"{'engine':<16}{'MAPE':>10}{'bias':>10}{'SKU-months':>12}{'seconds':>10}")
+    for engine, row in report.items():
+        mape = "-" if row["mape"] is None else f"{row['mape']:.1%}"
+        bias = "-" if row["bias"] is None else f"{row['bias']:+.1%}"
+        print(f"{engine:<16}{mape:>10}{bias:>10}{row['sku_months']:>12}{row['seconds']:>10}")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"months": args.months, "cases": len(cases), "engines": report}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,241 @@
+"""Loads the POC tables and builds the in-memory indexes served by app.py.
+
+Everything a request needs lives on one ``DataSnapshot``; a refresh builds
+a new snapshot and swaps the module reference in app.py, so in-flight
+requests keep reading the snapshot they started with.
+
+Tables come from the source named by PROPHET_DATA_SOURCE:
+
+- "csv" (default): the files in PROPHET_DATA_DIR, reloaded on refresh when
+  any of them changed.
+- "parquet": a columnar snapshot in PROPHET_SNAPSHOT_DIR written by
+  snapshot.py; only the columns below are read and string columns come back
+  as categoricals, so loading skips CSV parsing and type inference (the
+  frames are still copied into pandas memory). Reloaded when a file changed.
+- "mysql": the ``poc`` database (DB_HOST / DB_USER / DB_PASSWORD / DB_NAME,
+  as in src/api.py). A refresh only reads rows on or after each table's
+  watermark -- the latest ``bill_date`` / ``stock_date`` /
+  ``dispatch_date`` already loaded -- and replaces that last day, so rows
+  added late for the same day are picked up too. Edits to older rows need
+  a full reload.
+"""
+import hashlib
+import os
+
+import pandas as pd
+
+from hierarchy import HierarchyIndex
+from sales_cube import SalesCube
+from stock_index import StockIndex
+
+
+DATA_DIR = os.getenv("PROPHET_DATA_DIR", "data")
+SNAPSHOT_DIR = os.getenv("PROPHET_SNAPSHOT_DIR", os.path.join(DATA_DIR, "snapshot"))
+DATA_SOURCE = os.getenv("PROPHET_DATA_SOURCE", "csv")
+
+# Snapshot table -> (MySQL table / CSV file name, watermark column)
+TABLES = {
+    "retail": ("poc_retail", "bill_date"),
+    "wholesale": ("poc_wholesale", "dispatch_date"),
+    "stock": ("poc_stock_closing", "stock_date"),
+    "distillery": ("poc_distillery", "dispatch_date"),
+}
+
+# Columns the indexes use; everything else (etin, license_number, names,
+# tp_reference_number, ...) is dropped at load time
+COLUMNS = {
+    "retail": ["entity_code", "bill_date", "brand_name", "package_size", "sold_qty"],
+    "wholesale": ["from_entity_code", "to_entity_code", "dispatch_date", "dispatched_bottles"],
+    "stock": ["entity_code", "stock_date", "brand_name", "package_size", "closed_qty"],
+    "distillery": ["from_entity_code", "to_entity_code", "dispatch_date"],
+}
+
+# Low-cardinality string columns stored as categoricals
+CATEGORICAL = ("entity_code", "from_entity_code", "to_entity_code", "brand_name", "package_size")
+
+
+def fix_types(name, frame):
+    frame = frame[COLUMNS[name]].copy()
+
+    # Codes are compared as strings; repeated strings become categoricals
+    for column in frame.columns.intersection(CATEGORICAL):
+        if not isinstance(frame[column].dtype, pd.CategoricalDtype):
+            frame[column] = frame[column].astype(str)
+        frame[column] = frame[column].astype("category")
+
+    # Fix dates
+    date_column = TABLES[name][1]
+    frame[date_column] = pd.to_datetime(frame[date_column], errors="coerce")
+    return frame
+
+
+# ---------------------------------------------------------
+# DATA SOURCES
+# ---------------------------------------------------------
+class CsvSource:
+
+    def __init__(self, data_dir=DATA_DIR):
+        self.data_dir = data_dir
+        self._mtimes = None
+
+    def _path(self, name):
+        return os.path.join(self.data_dir, f"{TABLES[name][0]}.csv")
+
+    def _file_mtimes(self):
+        return {name: os.path.getmtime(self._path(name)) for name in TABLES}
+
+    def load(self):
+        self._mtimes = self._file_mtimes()
+        return {
+            name: fix_types(name, pd.read_csv(self._path(name), usecols=COLUMNS[name]))
+            for name in TABLES
+        }
+
+    def load_since(self, tables):
+        """All tables again if any file changed since the last load, else None."""
+        if self._file_mtimes() == self._mtimes:
+            return None
+        return self.load()
+
+
+class ParquetSource(CsvSource):
+    """Snapshot written by ``write_snapshot``; same reload rule as CSV."""
+
+    def __init__(self, data_dir=SNAPSHOT_DIR):
+        super().__init__(data_dir)
+
+    def _path(self, name):
+        return os.path.join(self.data_dir, f"{TABLES[name][0]}.parquet")
+
+    def load(self):
+        import pyarrow.parquet as pq
+
+        self._mtimes = self._file_mtimes()
+        return {
+            name: fix_types(name, pq.read_table(
+                self._path(name), columns=COLUMNS[name]
+            ).to_pandas())
+            for name in TABLES
+        }
+
+
+class MySQLSource:
+
+    def __init__(self):
+        from sqlalchemy import create_engine
+
+        self.engine = create_engine(
+            f"mysql+mysqlconnector://{os.getenv('DB_USER')}:{os.getenv('DB_PASSWORD')}@{os.getenv('DB_HOST')}:3306/{os.getenv('DB_NAME')}",
+            pool_pre_ping=True
+        )
+
+    def _read(self, name, since=None):
+        from sqlalchemy import text
+
+        table, date_column = TABLES[name]
+        columns = ", ".join(f"`{column}`" for column in COLUMNS[name])
+        query = f"SELECT {columns} FROM `{table}`"
+        params = {}
+        if since is not None:
+            query += f" WHERE `{date_column}` >= :since"
+            params["since"] = since.to_pydatetime()
+
+        with self.engine.connect() as conn:
+            return fix_types(name, pd.read_sql(text(query), conn, params=params))
+
+    def load(self):
+        return {name: self._read(name) for name in TABLES}
+
+    def load_since(self, tables):
+        """``tables`` with every row from its watermark on re-read, or None
+        when no table has new rows."""
+        merged = {}
+        changed = False
+        for name, frame in tables.items():
+            date_column = TABLES[name][1]
+            since = frame[date_column].max()
+            if pd.isna(since):
+                merged[name] = self._read(name)
+                changed = changed or len(merged[name]) > 0
+                continue
+
+            new = self._read(name, since)
+            dates = frame[date_column]
+            if len(new) == int((dates >= since).sum()) and new[date_column].max() <= since:
+                merged[name] = frame
+                continue
+
+            kept = frame[(dates < since) | dates.isna()]
+            merged[name] = fix_types(name, pd.concat([kept, new], ignore_index=True))
+            changed = True
+        return merged if changed else None
+
+
+SOURCES = {
+    "csv": CsvSource,
+    "parquet": ParquetSource,
+    "mysql": MySQLSource,
+}
+
+
+def make_source(kind=DATA_SOURCE):
+    if kind not in SOURCES:
+        raise ValueError(f"PROPHET_DATA_SOURCE must be one of {', '.join(SOURCES)}")
+    return SOURCES[kind]()
+
+
+# ---------------------------------------------------------
+# SNAPSHOT
+# ---------------------------------------------------------
+def data_version(retail):
+    """Content hash of the sales history; part of every model-cache key."""
+    hashed = pd.util.hash_pandas_object(
+        retail[["entity_code", "bill_date", "brand_name", "package_size", "sold_qty"]],
+        index=False
+    )
+    return hashlib.sha1(hashed.to_numpy().tobytes()).hexdigest()[:16]
+
+
+def snapshot_id(tables):
+    """Content hash of every table. Unlike ``data_version`` it changes with
+    stock and dispatch data too, which forecast rows (remaining stock,
+    quantity to raise, scopes) depend on."""
+    digest = hashlib.sha1()
+    for name in sorted(tables):
+        hashed = pd.util.hash_pandas_object(tables[name], index=False)
+        digest.update(name.encode("utf-8"))
+        digest.update(hashed.to_numpy().tobytes())
+    return digest.hexdigest()[:16]
+
+
+class DataSnapshot:
+
+    def __init__(self, tables):
+        self.tables = tables
+        self.retail = tables["retail"]
+        self.wholesale = tables["wholesale"]
+        self.stock = tables["stock"]
+        self.distillery = tables["distillery"]
+        self.version = data_version(self.retail)
+        self.id = snapshot_id(tables)
+
+        self.hierarchy = HierarchyIndex(self.wholesale, self.distillery)
+        self.sales = SalesCube(self.retail)
+        self.stock_index = StockIndex(self.stock)
+
+
+def load_snapshot(source=None):
+    return DataSnapshot((source or make_source()).load())
+
+
+def write_snapshot(tables, snapshot_dir=SNAPSHOT_DIR):
+    """Write ``tables`` as the Parquet snapshot read by ``ParquetSource``."""
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    os.makedirs(snapshot_dir, exist_ok=True)
+    for name, frame in tables.items():
+        path = os.path.join(snapshot_dir, f"{TABLES[name][0]}.parquet")
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        pq.write_table(pa.Table.from_pandas(frame, preserve_index=False), tmp_path)
+        os.replace(tmp_path, path)
@@ -0,0 +1,139 @@
+"""Vectorized NumPy forecasters: an alternative to per-SKU Prophet fits.
+
+Every SKU series of a scope is one row of a (SKUs x days) matrix with NaN
+on days that had no retail record. Each engine fits all rows at once and
+returns a (SKUs x horizon) matrix of daily forecasts, so a whole depot or
+distillery is forecast in milliseconds instead of one Stan run per SKU.
+
+- ``seasonal_naive``: per weekday, the mean of the last few weeks.
+- ``holt_winters``: additive Holt-Winters with damped trend and weekly
+  season; smoothing parameters are picked per SKU from a small grid by
+  one-step-ahead squared error, with every grid point run side by side.
+"""
+import itertools
+
+import numpy as np
+import pandas as pd
+
+from forecasting import MIN_POINTS
+
+
+SEASON = 7          # weekly seasonality of daily retail sales
+NAIVE_WEEKS = 4     # weeks averaged by seasonal_naive
+DAMPING = 0.98
+
+HW_GRID = np.array(list(itertools.product(
+    (0.1, 0.3, 0.5),       # alpha: level
+    (0.0, 0.05, 0.15),     # beta: trend
+    (0.05, 0.2, 0.4),      # gamma: season
+)))
+
+
+def _row_means(block):
+    """Mean of the observed values in each row; NaN for rows with none."""
+    observed = ~np.isnan(block)
+    counts = observed.sum(axis=1)
+    totals = np.where(observed, block, 0.0).sum(axis=1)
+    return np.divide(totals, counts, out=np.full(len(block), np.nan), where=counts > 0)
+
+
+def seasonal_naive(matrix, horizon):
+    n_rows, n_days = matrix.shape
+    recent_days = min(n_days, max(n_days // SEASON, 1) * SEASON, NAIVE_WEEKS * SEASON)
+    recent = matrix[:, n_days - recent_days:]
+    weekday = np.arange(n_days - recent_days, n_days) % SEASON
+
+    # Mean of recent observed days per weekday (column t has weekday t % SEASON)
+    by_weekday = np.stack(
+        [_row_means(recent[:, weekday == d]) for d in range(SEASON)], axis=1
+    )
+    fallback = np.nan_to_num(_row_means(matrix))[:, None]
+    by_weekday = np.where(np.isnan(by_weekday), fallback, by_weekday)
+
+    future_weekday = (n_days + np.arange(horizon)) % SEASON
+    return by_weekday[:, future_weekday]
+
+
+def holt_winters(matrix, horizon):
+    n_rows, n_days = matrix.shape
+    alpha, beta, gamma = (HW_GRID[:, i][:, None] for i in range(3))   # (C, 1)
+    n_combos = len(HW_GRID)
+
+    # Initial state from the first season of observed values
+    first = matrix[:, :SEASON]
+    level0 = _row_means(first)
+    level0 = np.nan_to_num(np.where(np.isnan(level0), _row_means(matrix), level0))
+    level = np.repeat(level0[None, :], n_combos, axis=0)                # (C, S)
+    trend = np.zeros_like(level)
+    season = np.zeros((n_combos, n_rows, SEASON))
+    season[:, :, :first.shape[1]] = np.nan_to_num(first - level0[:, None])[None, :, :]
+
+    sse = np.zeros_like(level)
+    for t in range(n_days):
+        y = matrix[:, t][None, :]                                       # (1, S)
+        observed = ~np.isnan(y)
+        s = season[:, :, t % SEASON]
+
+        predicted = level + DAMPING * trend + s
+        sse += np.where(observed, (np.nan_to_num(y) - predicted) ** 2, 0.0)
+
+        new_level = alpha * (y - s) + (1 - alpha) * (level + DAMPING * trend)
+        new_trend = beta * (new_level - level) + (1 - beta) * DAMPING * trend
+        new_season = gamma * (y - new_level) + (1 - gamma) * s
+
+        # Days without a record only advance the trend
+        level = np.where(observed, new_level, level + DAMPING * trend)
+        trend = np.where(observed, new_trend, DAMPING * trend)
+        season[:, :, t % SEASON] = np.where(observed, new_season, s)
+
+    # Best grid point per SKU
+    best = np.argmin(sse, axis=0)
+    rows = np.arange(n_rows)
+    level, trend, season = level[best, rows], trend[best, rows], season[best, rows]
+
+    steps = np.arange(1, horizon + 1)
+    damped = np.cumsum(DAMPING ** steps)
+    future_weekday = (n_days + steps - 1) % SEASON
+    forecast = level[:, None] + trend[:, None] * damped[None, :] + season[:, future_weekday]
+    return np.clip(forecast, 0.0, None)
+
+
+ENGINES = {
+    "seasonal_naive": seasonal_naive,
+    "holt_winters": holt_winters,
+}
+
+
+def matrix_demands(window, train_start, train_end, predict_ranges, engine):
+    """Total forecast over ``predict_ranges`` for every SKU row of ``window``."""
+    totals = matrix_range_totals(window, train_start, train_end, predict_ranges, engine)
+    demands = np.zeros(len(window.skus))
+    for column in totals.T:
+        demands += column
+    return [float(d) for d in demands]
+
+
+def matrix_range_totals(window, train_start, train_end, predict_ranges, engine):
+    """(SKUs x ranges) forecast total of every SKU row of ``window`` per
+    predict range, from one forecast over the whole horizon.
+
+    Rows with fewer than MIN_POINTS observed days get 0.0, as with Prophet.
+    """
+    days = pd.date_range(train_start, train_end)
+    matrix = np.full((len(window.skus), len(days)), np.nan)
+    if len(window.dates):
+        cols = days.get_indexer(window.dates)
+        matrix[:, cols[cols >= 0]] = window.totals[:, cols >= 0]
+
+    last_day = max(end for _, end in predict_ranges)
+    horizon = max((pd.Timestamp(last_day) - days[-1]).days, 0)
+    forecast = ENGINES[engine](matrix, horizon)
+    future = days[-1] + pd.to_timedelta(np.arange(1, horizon + 1), unit="D")
+
+    totals = np.zeros((len(window.skus), len(predict_ranges)))
+    for r, (start, end) in enumerate(predict_ranges):
+        in_range = (future >= start) & (future <= end)
+        totals[:, r] = forecast[:, in_range].sum(axis=1)
+
+    enough = (~np.isnan(matrix)).sum(axis=1) >= MIN_POINTS
+    return np.where(enough[:, None], totals, 0.0)
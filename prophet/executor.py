@@ -0,0 +1,274 @@
+"""Process pool that spreads per-SKU Prophet fits across CPU cores.
+
+The pool runs fits in submission order. Background work (long-lane jobs,
+backtests) passes a ``FitBudget`` so it only keeps that many fits
+submitted at a time; fits of interactive requests, submitted without
+one, then queue behind at most those instead of behind a whole
+distillery. ``ForecastExecutor.background`` leaves one worker free for
+them (PROPHET_BACKGROUND_WORKERS, default all workers but one).
+"""
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+
+from forecasting import MIN_POINTS, fit_forecast, init_worker, preload, total_demand
+
+
+MAX_WORKERS = int(os.getenv("PROPHET_WORKERS", os.cpu_count() or 1))
+
+# Start every refit from the series' last fitted parameters (needs a cache)
+WARM_START = os.getenv("PROPHET_WARM_START", "0") == "1"
+
+BACKGROUND_WORKERS = int(os.getenv("PROPHET_BACKGROUND_WORKERS", max(1, MAX_WORKERS - 1)))
+
+# How often a bounded submitter waiting for a slot hands back finished fits
+BUDGET_POLL_SECONDS = 0.1
+
+
+class FitBudget:
+    """At most ``limit`` fits in flight, and within the ``parent`` budget."""
+
+    def __init__(self, limit, parent=None):
+        self.limit = max(1, limit)
+        self.parent = parent
+        self._slots = threading.Semaphore(self.limit)
+
+    def acquire(self, timeout=None):
+        if not self._slots.acquire(timeout=timeout):
+            return False
+        if self.parent is not None and not self.parent.acquire(timeout):
+            self._slots.release()
+            return False
+        return True
+
+    def release(self):
+        if self.parent is not None:
+            self.parent.release()
+        self._slots.release()
+
+
+class ForecastExecutor:
+
+    def __init__(self, max_workers=MAX_WORKERS, cache=None, warm_start=WARM_START,
+                 background_workers=BACKGROUND_WORKERS):
+        self.max_workers = max(1, max_workers)
+        self.background = FitBudget(min(background_workers, self.max_workers))
+        self.cache = cache
+        self.warm_start = warm_start and cache is not None
+        self._pool = None
+        self._lock = threading.Lock()
+        self._fits = {
+            kind: {"fits": 0, "iterations": 0, "seconds": 0.0} for kind in ("cold", "warm")
+        }
+
+    def _get_pool(self):
+        # Import Prophet before forking so workers inherit it (no-op once done)
+        preload()
+        with self._lock:
+            if self._pool is None:
+                # Workers are forked so they inherit the imported modules; each
+                # one loads the Stan model once in init_worker().
+                context = (
+                    multiprocessing.get_context("fork")
+                    if "fork" in multiprocessing.get_all_start_methods() else None
+                )
+                self._pool = ProcessPoolExecutor(
+                    max_workers=self.max_workers,
+                    mp_context=context,
+                    initializer=init_worker
+                )
+            return self._pool
+
+    def _discard_pool(self, pool):
+        with self._lock:
+            if self._pool is pool:
+                self._pool = None
+        pool.shutdown(wait=False, cancel_futures=True)
+
+    def warm(self):
+        """Fork every pool worker now instead of on the first forecast."""
+        if self.max_workers == 1:
+            preload()
+            return
+        pool = self._get_pool()
+        for future in [pool.submit(init_worker) for _ in range(self.max_workers)]:
+            future.result()
+
+    def imap_unordered(self, fn, tasks, budget=None):
+        """Yield (task index, fn(*task)) for every task as each one finishes.
+
+        With a ``budget`` each task waits for one of its slots before it is
+        submitted, so the rest stay off the pool's queue.
+        """
+        tasks = list(tasks)
+        if self.max_workers == 1 or len(tasks) <= 1:
+            if tasks:
+                # Fits in this process load Prophet here (and mark the
+                # backend ready) when nothing preloaded it
+                preload()
+            for i, task in enumerate(tasks):
+                if budget is not None:
+                    budget.acquire()
+                try:
+                    result = fn(*task)
+                finally:
+                    if budget is not None:
+                        budget.release()
+                yield i, result
+            return
+
+        pool = self._get_pool()
+        try:
+            if budget is None:
+                futures = {pool.submit(fn, *task): i for i, task in enumerate(tasks)}
+            else:
+                futures = {}
+                for i, task in enumerate(tasks):
+                    while not budget.acquire(BUDGET_POLL_SECONDS):
+                        yield from self._pop_done(futures)
+                    try:
+                        future = pool.submit(fn, *task)
+                    except BaseException:
+                        budget.release()
+                        raise
+                    future.add_done_callback(lambda _: budget.release())
+                    futures[future] = i
+            for future in as_completed(futures):
+                yield futures[future], future.result()
+        except BrokenProcessPool:
+            # A worker died (e.g. OOM-killed); start a fresh pool next time
+            self._discard_pool(pool)
+            raise
+
+    def forecast(self, jobs, progress=None):
+        """Total forecast demand for each (sku_df, predict_ranges, key,
+        warm_key, profile) job."""
+        return [total_demand(totals) for totals in self.forecast_ranges(jobs, progress)]
+
+    @staticmethod
+    def _pop_done(futures):
+        for future in [future for future in futures if future.done()]:
+            yield futures.pop(future), future.result()
+
+    def forecast_ranges(self, jobs, progress=None, budget=None):
+        """Forecast per predict range for each job.
+
+        ``progress(done, total)`` is called with the number of jobs whose
+        forecast is known each time it grows.
+        """
+        range_totals = [None] * len(jobs)
+        for done, (i, totals) in enumerate(self.forecast_iter(jobs, budget), 1):
+            range_totals[i] = totals
+            if progress is not None:
+                progress(done, len(jobs))
+        return range_totals
+
+    def forecast_iter(self, jobs, budget=None):
+        """Yield (job index, forecast per predict range) for each (sku_df,
+        predict_ranges, key, warm_key, profile) job as soon as it is known.
+
+        Series with fewer than MIN_POINTS daily points are not fitted and
+        get a demand of 0.0. Jobs sharing a cache key (same shops, SKU,
+        window and data version) share one model: it is taken from the
+        cache or fitted once, and predicts the union of their month ranges.
+        The key includes the forecast profile, so jobs that share a model
+        also share its configuration.
+        All fits of all jobs are scheduled on the pool together (within
+        ``budget``, if given); unfitted and cached jobs come first, the
+        rest in order of fit completion.
+
+        With warm starts on, a series fitted before (same ``warm_key``:
+        shops and SKU) starts from its last parameters.
+        """
+        groups = {}     # cache key (or job index) -> one model to fit / reuse
+
+        for i, (sku_df, predict_ranges, key, warm_key, profile) in enumerate(jobs):
+            if len(sku_df) < MIN_POINTS:
+                yield i, [0.0] * len(predict_ranges)
+                continue
+            if self.cache is None:
+                key = None
+            group_id = key if key is not None else ("job", i)
+
+            group = groups.get(group_id)
+            if group is None:
+                entry = self.cache.get(key) if key is not None else None
+                group = groups[group_id] = {
+                    "series": sku_df,
+                    "key": key,
+                    "warm_key": warm_key if self.warm_start else None,
+                    "profile": profile,
+                    "model": entry["model"] if entry is not None else None,
+                    "forecasts": entry["forecasts"] if entry is not None else {},
+                    "missing": {},
+                    "jobs": [],
+                }
+            group["jobs"].append((i, predict_ranges))
+            for month_range in predict_ranges:
+                if month_range not in group["forecasts"]:
+                    group["missing"][month_range] = None
+
+        pending = []
+        for group in groups.values():
+            if group["missing"]:
+                pending.append(group)
+            else:
+                yield from self._group_totals(group)
+
+        results = self.imap_unordered(fit_forecast, [
+            (group["series"], list(group["missing"]), group["model"], self._init(group),
+             group["profile"])
+            for group in pending
+        ], budget)
+        for index, (range_totals, model_json, fit) in results:
+            group = pending[index]
+            new_forecasts = dict(zip(group["missing"], range_totals))
+            group["forecasts"] = {**group["forecasts"], **new_forecasts}
+            if group["key"] is not None:
+                self.cache.put(group["key"], model_json, new_forecasts)
+            if fit is not None:
+                self._record_fit(group, fit)
+            yield from self._group_totals(group)
+
+    def _init(self, group):
+        if group["model"] is not None or group["warm_key"] is None:
+            return None
+        return self.cache.get_params(group["warm_key"])
+
+    def _record_fit(self, group, fit):
+        with self._lock:
+            totals = self._fits["warm" if fit["warm"] else "cold"]
+            totals["fits"] += 1
+            totals["iterations"] += fit["iterations"]
+            totals["seconds"] += fit["seconds"]
+        if group["warm_key"] is not None:
+            self.cache.put_params(group["warm_key"], fit["params"])
+
+    def stats(self):
+        """Fit counts, optimizer iterations and seconds for cold and warm
+        fits; the savings assume a warm fit would otherwise have cost an
+        average cold fit."""
+        with self._lock:
+            cold, warm = (dict(self._fits[kind]) for kind in ("cold", "warm"))
+        stats = {"warm_start": self.warm_start, "cold": cold, "warm": warm}
+        if cold["fits"] and warm["fits"]:
+            stats["saved"] = {
+                "iterations": round(cold["iterations"] / cold["fits"] * warm["fits"]
+                                    - warm["iterations"]),
+                "seconds": round(cold["seconds"] / cold["fits"] * warm["fits"]
+                                 - warm["seconds"], 3),
+            }
+        return stats
+
+    @staticmethod
+    def _group_totals(group):
+        for i, predict_ranges in group["jobs"]:
+            yield i, [group["forecasts"][month_range] for month_range in predict_ranges]
+
+    def shutdown(self):
+        with self._lock:
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.shutdown(wait=True)
@@ -0,0 +1,188 @@
+"""Per-SKU Prophet fitting used by the forecast routes and pool workers.
+
+``prophet`` and ``cmdstanpy`` are imported on first use rather than with
+this module, so the HTTP layer (and the NumPy engines) start without them.
+``preload()`` does the import and loads the Stan model ahead of the first
+request; pool workers forked after it inherit the loaded modules and only
+create their own backend object.
+
+A forecast profile (``PROFILES``) sets the Prophet configuration of a
+request's models:
+
+- "fast" (default, PROPHET_PROFILE): no uncertainty sampling, and no
+  yearly or daily seasonality -- the training windows are a few months of
+  daily sales, too short for either. Only yhat is computed.
+- "standard": Prophet's defaults.
+- "full-intervals": Prophet's defaults plus prediction intervals of each
+  forecast total, from the model's posterior predictive samples.
+"""
+import os
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+
+
+# Series with fewer daily points than this are not fitted: demand = 0
+MIN_POINTS = 5
+
+PROFILES = {
+    "fast": {
+        "prophet": {"uncertainty_samples": 0, "yearly_seasonality": False,
+                    "daily_seasonality": False},
+        "intervals": False,
+    },
+    "standard": {"prophet": {}, "intervals": False},
+    "full-intervals": {"prophet": {}, "intervals": True},
+}
+DEFAULT_PROFILE = os.getenv("PROPHET_PROFILE", "fast")
+
+
+def total_demand(range_totals):
+    """Demand over all predict ranges of one series."""
+    demand = 0.0
+    for total in range_totals:
+        demand += total
+    return demand
+
+
+_local = threading.local()
+_prophet_class = None
+_import_lock = threading.Lock()
+
+# Set once preload() has imported Prophet and loaded the Stan model
+ready = threading.Event()
+preload_seconds = None
+
+
+def stan_backend():
+    """Stan backend for this thread, loaded on first use and then reused.
+
+    Prophet() loads the compiled Stan model on every construction; pool
+    workers call this once from init_worker() and every later model in the
+    process shares the loaded backend.
+    """
+    backend = getattr(_local, "backend", None)
+    if backend is None:
+        from prophet.models import StanBackendEnum
+
+        backend = StanBackendEnum.get_backend_class(StanBackendEnum.CMDSTANPY.name)()
+        _local.backend = backend
+    return backend
+
+
+def prophet_class():
+    """Prophet subclass whose models share the thread's Stan backend."""
+    global _prophet_class
+    with _import_lock:
+        if _prophet_class is None:
+            from prophet import Prophet
+
+            class SharedBackendProphet(Prophet):
+
+                def _load_stan_backend(self, stan_backend_name):
+                    self.stan_backend = stan_backend()
+
+            _prophet_class = SharedBackendProphet
+    return _prophet_class
+
+
+def preload():
+    """Import Prophet and load the Stan model in this process."""
+    global preload_seconds
+    started = time.perf_counter()
+    prophet_class()
+    stan_backend()
+    import prophet.serialize    # noqa: F401
+    if preload_seconds is None:
+        preload_seconds = time.perf_counter() - started
+    ready.set()
+
+
+def init_worker():
+    stan_backend()
+
+
+def warm_start_params(model):
+    """Fitted parameters of ``model`` as Stan inits for a later refit."""
+    return {
+        "k": float(model.params["k"][0][0]),
+        "m": float(model.params["m"][0][0]),
+        "sigma_obs": float(model.params["sigma_obs"][0][0]),
+        "delta": model.params["delta"][0].tolist(),
+        "beta": model.params["beta"][0].tolist(),
+    }
+
+
+def fit_forecast(sku_df, predict_ranges, model_json=None, init=None, profile=DEFAULT_PROFILE):
+    """Yhat total for each (start, end) range, the model as JSON, and fit
+    stats (None when a cached ``model_json`` is reused as-is).
+
+    A ("lower" | "upper", start, end) range gets that bound of the
+    prediction interval of the total over start..end instead; it needs a
+    model with uncertainty samples (the "full-intervals" profile).
+
+    ``init`` -- warm_start_params() of an earlier fit of the same series --
+    starts the optimizer from those parameters instead of Prophet's
+    default initialization; delta / beta of a different shape fall back to
+    the default.
+    """
+    from prophet.serialize import model_from_json, model_to_json
+
+    fit = None
+    if model_json is not None:
+        model = model_from_json(model_json)
+    else:
+        model = prophet_class()(**PROFILES[profile]["prophet"])
+        kwargs = {}
+        if init is not None:
+            kwargs["init"] = {
+                **init, "delta": np.array(init["delta"]), "beta": np.array(init["beta"])
+            }
+
+        started = time.perf_counter()
+        model.fit(sku_df, save_iterations=True, **kwargs)
+        seconds = time.perf_counter() - started
+
+        # Constant series are not optimized; stan_fit is then a stale one
+        history = model.history["y"]
+        iterations = 0 if history.min() == history.max() else \
+            len(model.stan_fit.optimized_iterations_np)
+
+        model_json = model_to_json(model)
+        fit = {
+            "warm": init is not None,
+            "iterations": iterations,
+            "seconds": seconds,
+            "params": warm_start_params(model),
+        }
+
+    # One predict over every day of every range, then a total per range
+    days = pd.DatetimeIndex([])
+    for *_, start, end in predict_ranges:
+        days = days.union(pd.date_range(start=start, end=end))
+    if len(days) == 0:
+        return [0.0] * len(predict_ranges), model_json, fit
+
+    future = pd.DataFrame({"ds": days})
+    forecast = model.predict(future)
+    yhat = forecast.set_index("ds")["yhat"]
+
+    # Interval bounds of a total come from summing each sample path over
+    # the range, not from summing the daily bounds
+    samples = None
+    if any(len(month_range) == 3 for month_range in predict_ranges):
+        samples = model.predictive_samples(future)["yhat"]
+    tail = (1 - model.interval_width) / 2
+
+    totals = []
+    for month_range in predict_ranges:
+        if len(month_range) == 2:
+            start, end = month_range
+            totals.append(float(yhat.loc[start:end].sum()))
+        else:
+            bound, start, end = month_range
+            path_totals = samples[(days >= start) & (days <= end)].sum(axis=0)
+            totals.append(float(np.quantile(path_totals, tail if bound == "lower" else 1 - tail)))
+    return totals, model_json, fit
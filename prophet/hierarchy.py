@@ -0,0 +1,72 @@
+"""Supply-chain hierarchy index: distillery -> depots -> retail shops.
+
+Built once from the dispatch tables so that resolving the scope of a
+forecast request is a dictionary lookup instead of a CSV parse and a
+boolean-mask scan over ``wholesale``.
+
+A retail shop can be supplied by several depots. For hierarchical
+forecasting every shop is also assigned to exactly one *primary* depot --
+the one that dispatched the most bottles to it -- so that depot-level
+series partition the network and sum to distillery totals without
+counting a shop twice.
+"""
+
+
+def _group_unique(frame, key_col, value_col):
+    # {key: (values in first-seen order)} -- same order as Series.unique()
+    grouped = {}
+    for key, value in zip(frame[key_col], frame[value_col]):
+        grouped.setdefault(key, {})[value] = None
+    return {key: tuple(values) for key, values in grouped.items()}
+
+
+class HierarchyIndex:
+
+    def __init__(self, wholesale, distillery):
+        # Downward lookups
+        self.depot_shops = _group_unique(wholesale, "from_entity_code", "to_entity_code")
+        self.distillery_depots = _group_unique(distillery, "from_entity_code", "to_entity_code")
+
+        # Distillery -> retail shops under all of its depots
+        self.distillery_shops = {}
+        for distillery_id, depots in self.distillery_depots.items():
+            shops = {}
+            for depot in depots:
+                shops.update(dict.fromkeys(self.depot_shops.get(depot, ())))
+            self.distillery_shops[distillery_id] = tuple(shops)
+
+        # Shop -> primary depot, and depot -> the shops it is primary for
+        self.shop_primary_depot = {}
+        if len(wholesale):
+            volume = (
+                wholesale.groupby(["to_entity_code", "from_entity_code"],
+                                  sort=False, observed=True)
+                ["dispatched_bottles"].sum()
+                .reset_index()
+            )
+            # Stable sort: ties go to the depot seen first
+            volume = volume.sort_values("dispatched_bottles", ascending=False, kind="stable")
+            for shop, depot in zip(volume["to_entity_code"], volume["from_entity_code"]):
+                self.shop_primary_depot.setdefault(shop, depot)
+
+        self.depot_base_shops = {}
+        for depot, shops in self.depot_shops.items():
+            self.depot_base_shops[depot] = tuple(
+                shop for shop in shops if self.shop_primary_depot.get(shop) == depot
+            )
+
+    # ---------------------------------------------------------
+    # LOOKUPS
+    # ---------------------------------------------------------
+    def shops_for_depot(self, depot_id):
+        return self.depot_shops.get(depot_id, ())
+
+    def depots_for_distillery(self, distillery_id):
+        return self.distillery_depots.get(distillery_id, ())
+
+    def base_shops_for_depot(self, depot_id):
+        """Shops whose primary depot is ``depot_id``."""
+        return self.depot_base_shops.get(depot_id, ())
+
+    def shops_for_distillery(self, distillery_id):
+        return self.distillery_shops.get(distillery_id, ())
@@ -0,0 +1,127 @@
+"""Background forecast jobs with per-SKU progress.
+
+A job is submitted to one of three lanes, each a bounded queue served by
+its own worker threads: "short" for NumPy-engine and small Prophet jobs,
+"long" for big Prophet fits such as a whole distillery, and "background"
+for the service's own work (materializing forecasts after a refresh). A
+long job can only hold up other long jobs, and background work none of
+them. When a lane's queue is full ``submit`` raises ``queue.Full`` and
+the route answers 503.
+
+Finished jobs are kept (newest PROPHET_JOB_KEEP) so their result can be
+fetched later. The model fits themselves run on the shared
+ForecastExecutor process pool; long-lane fits are held to the
+executor's background budget there (background-lane fits to a smaller
+one inside it), so the lanes stay apart on the pool too.
+"""
+import logging
+import os
+import queue
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+
+SHORT_WORKERS = int(os.getenv("PROPHET_JOB_SHORT_WORKERS", "2"))
+LONG_WORKERS = int(os.getenv("PROPHET_JOB_LONG_WORKERS", "1"))
+BACKGROUND_WORKERS = int(os.getenv("PROPHET_JOB_BACKGROUND_WORKERS", "1"))
+QUEUE_SIZE = int(os.getenv("PROPHET_JOB_QUEUE", "100"))
+KEEP_JOBS = int(os.getenv("PROPHET_JOB_KEEP", "1000"))
+
+
+class Job:
+
+    def __init__(self, lane, fn, total, meta):
+        self.id = uuid.uuid4().hex
+        self.lane = lane
+        self.fn = fn                    # fn(job) -> result
+        self.meta = meta
+        self.status = "queued"
+        self.done = 0
+        self.total = total              # SKU series to forecast
+        self.result = None
+        self.error = None
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+
+    def progress(self, done, total):
+        self.done, self.total = done, total
+
+    def to_dict(self):
+        return {
+            "job_id": self.id,
+            "lane": self.lane,
+            "status": self.status,
+            "progress": {"done": self.done, "total": self.total},
+            "error": self.error,
+            "created": self.created,
+            "started": self.started,
+            "finished": self.finished,
+            **self.meta,
+        }
+
+
+class JobQueue:
+
+    def __init__(self, short_workers=SHORT_WORKERS, long_workers=LONG_WORKERS,
+                 queue_size=QUEUE_SIZE, keep=KEEP_JOBS, background_workers=BACKGROUND_WORKERS):
+        self.keep = keep
+        self._jobs = OrderedDict()      # id -> Job, oldest first
+        self._lock = threading.Lock()
+        self._queues = {}
+
+        for lane, workers in (("short", short_workers), ("long", long_workers),
+                              ("background", background_workers)):
+            self._queues[lane] = queue.Queue(maxsize=queue_size)
+            for n in range(max(1, workers)):
+                threading.Thread(
+                    target=self._work, args=(self._queues[lane],),
+                    name=f"forecast-{lane}-{n}", daemon=True
+                ).start()
+
+    def submit(self, lane, fn, total=0, **meta):
+        job = Job(lane, fn, total, meta)
+        with self._lock:
+            self._jobs[job.id] = job
+            try:
+                self._queues[lane].put_nowait(job)
+            except queue.Full:
+                del self._jobs[job.id]
+                raise
+            self._prune()
+        return job
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def stats(self):
+        with self._lock:
+            counts = {}
+            for job in self._jobs.values():
+                counts[job.status] = counts.get(job.status, 0) + 1
+        return {
+            "jobs": counts,
+            "queued": {lane: q.qsize() for lane, q in self._queues.items()},
+        }
+
+    def _prune(self):
+        # Drop the oldest finished jobs beyond the retention limit
+        finished = [job_id for job_id, job in self._jobs.items() if job.finished is not None]
+        for job_id in finished[:max(0, len(self._jobs) - self.keep)]:
+            del self._jobs[job_id]
+
+    def _work(self, jobs):
+        while True:
+            job = jobs.get()
+            job.status, job.started = "running", time.time()
+            try:
+                job.result = job.fn(job)
+                job.status = "done"
+            except Exception as e:
+                logging.exception("Forecast job %s failed", job.id)
+                job.status, job.error = "failed", str(e)
+            job.finished = time.time()
+            jobs.task_done()
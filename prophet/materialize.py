@@ -0,0 +1,143 @@
+"""Precomputed forecasts for the coming month, served from a store.
+
+After every data refresh app.py queues one background job that forecasts
+every depot, distillery and intent scope for the month after the latest
+sale (training window PROPHET_MATERIALIZE_MONTHS, each engine in
+PROPHET_MATERIALIZE_ENGINES and mode in PROPHET_MATERIALIZE_MODES, all
+with the default forecast profile) and puts the rows into a
+``ForecastStore``. The forecast routes answer from
+the store when it holds their exact request for the current snapshot
+(``DataSnapshot.id``, a hash of every table, so new stock or dispatch
+data invalidates it as well as new sales); ``"live": true`` in the body
+forces a recompute.
+
+The job runs in the job queue's "background" lane and keeps at most
+PROPHET_MATERIALIZE_FITS fits in flight (default half the workers),
+within the executor's background budget, so requests served meanwhile
+always find a free pool worker.
+
+With PROPHET_FORECAST_STORE_DIR set the store is also written to
+``forecasts.json`` there, so a restart on the same data serves at once.
+"""
+import json
+import logging
+import os
+import threading
+import time
+
+from executor import MAX_WORKERS
+from forecasting import DEFAULT_PROFILE
+
+
+ENABLED = os.getenv("PROPHET_MATERIALIZE", "1") != "0"
+MONTHS = int(os.getenv("PROPHET_MATERIALIZE_MONTHS", "2"))
+ENGINES = tuple(os.getenv("PROPHET_MATERIALIZE_ENGINES", "prophet").split(","))
+MODES = tuple(os.getenv("PROPHET_MATERIALIZE_MODES", "direct").split(","))
+STORE_DIR = os.getenv("PROPHET_FORECAST_STORE_DIR") or None
+FITS = int(os.getenv("PROPHET_MATERIALIZE_FITS", max(1, MAX_WORKERS // 2)))
+
+
+def item_key(item):
+    return (item["scope"], item["id"], item["from_month"], item["month"],
+            item["engine"], item["mode"], item["profile"])
+
+
+def materialize_items(snapshot, months=MONTHS, engines=ENGINES, modes=MODES):
+    """Batch items (see app.expand_batch) for every scope of ``snapshot``."""
+    if len(snapshot.sales.dates) == 0:
+        return []
+
+    # The routes take the forecast year from the latest sale, so the
+    # coming month has to be in the same year
+    from_month = snapshot.sales.dates[-1].month + 1
+    if from_month > 12:
+        return []
+
+    scopes = [("depot", depot) for depot in snapshot.hierarchy.depot_shops] + [
+        (scope, distillery)
+        for distillery in snapshot.hierarchy.distillery_depots
+        for scope in ("distillery", "intent")
+    ]
+    return [
+        {"scope": scope, "id": scope_id, "from_month": from_month, "month": months,
+         "engine": engine, "mode": mode, "horizon": None,
+         "profile": DEFAULT_PROFILE, "allocate": False}
+        for scope, scope_id in scopes
+        for engine in engines
+        for mode in modes
+    ]
+
+
+class ForecastStore:
+
+    def __init__(self, store_dir=STORE_DIR):
+        self.store_dir = store_dir
+        self.version = None
+        self.computed_at = None
+        self.seconds = None
+        self._rows = {}                 # item_key -> result rows
+        self._lock = threading.Lock()
+        self.hits = 0
+
+        if store_dir:
+            os.makedirs(store_dir, exist_ok=True)
+            self._load()
+
+    def _path(self):
+        return os.path.join(self.store_dir, "forecasts.json")
+
+    def _load(self):
+        try:
+            with open(self._path()) as f:
+                stored = json.load(f)
+        except (OSError, ValueError):
+            return
+        self.version = stored["version"]
+        self.computed_at = stored["computed_at"]
+        self.seconds = stored["seconds"]
+        self._rows = {tuple(entry["key"]): entry["results"] for entry in stored["entries"]}
+
+    def _save(self):
+        stored = {
+            "version": self.version,
+            "computed_at": self.computed_at,
+            "seconds": self.seconds,
+            "entries": [{"key": list(key), "results": rows} for key, rows in self._rows.items()],
+        }
+        tmp_path = f"{self._path()}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp_path, "w") as f:
+                json.dump(stored, f)
+            os.replace(tmp_path, self._path())
+        except OSError:
+            logging.exception("Could not write forecast store")
+
+    def get(self, version, item):
+        with self._lock:
+            if version != self.version:
+                return None
+            rows = self._rows.get(item_key(item))
+            if rows is not None:
+                self.hits += 1
+            return rows
+
+    def replace(self, version, items, seconds):
+        """Make the forecasted ``items`` of ``version`` the store's content."""
+        rows = {item_key(item): item["results"] for item in items if "results" in item}
+        with self._lock:
+            self.version = version
+            self.computed_at = time.time()
+            self.seconds = round(seconds, 3)
+            self._rows = rows
+            if self.store_dir:
+                self._save()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "version": self.version,
+                "entries": len(self._rows),
+                "computed_at": self.computed_at,
+                "seconds": self.seconds,
+                "hits": self.hits,
+            }
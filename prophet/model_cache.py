@@ -0,0 +1,194 @@
+"""LRU cache of fitted Prophet models keyed by series and data version.
+
+A key identifies one training series: the set of retail shops it sums,
+the SKU, the training window and the data snapshot version, plus the
+forecast profile the model was configured with. Models are
+kept as Prophet JSON (``prophet.serialize.model_to_json``) so the memory
+bound is simply the size of the stored strings, and the same text can be
+written to disk to survive restarts. Forecast totals already computed for
+a model are kept next to it, per (month start, month end) range, so
+identical requests skip ``predict`` too.
+
+With PROPHET_MODEL_CACHE_DIR set, models are also written there as
+``{key}.json``. The directory is bounded by PROPHET_MODEL_CACHE_DISK_MB
+(default: the memory bound) the same way, least recently used files
+deleted first, so models of old data versions do not pile up.
+
+The cache also keeps the last fitted parameters of every series under a
+key without data version or training window (``warm_key``), so a refit
+after new sales arrive can warm-start from them.
+"""
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+
+
+CACHE_MB = float(os.getenv("PROPHET_MODEL_CACHE_MB", "256"))
+CACHE_DIR = os.getenv("PROPHET_MODEL_CACHE_DIR") or None
+DISK_MB = float(os.getenv("PROPHET_MODEL_CACHE_DISK_MB", str(CACHE_MB)))
+WARM_PARAMS_MAX = int(os.getenv("PROPHET_WARM_PARAMS_MAX", "100000"))
+
+
+def series_key(version, shops, sku, train_start, train_end, profile):
+    brand, size = sku
+    parts = [
+        profile,
+        version,
+        ",".join(sorted(shops)),
+        brand,
+        size,
+        str(train_start),
+        str(train_end),
+    ]
+    return hashlib.sha1("\x1f".join(parts).encode("utf-8")).hexdigest()
+
+
+def warm_key(shops, sku):
+    brand, size = sku
+    parts = [",".join(sorted(shops)), brand, size]
+    return hashlib.sha1("\x1f".join(parts).encode("utf-8")).hexdigest()
+
+
+class ModelCache:
+
+    def __init__(self, max_bytes=int(CACHE_MB * 1024 * 1024), cache_dir=CACHE_DIR,
+                 max_params=WARM_PARAMS_MAX, max_disk_bytes=int(DISK_MB * 1024 * 1024)):
+        self.max_bytes = max_bytes
+        self.cache_dir = cache_dir
+        self.max_params = max_params
+        self.max_disk_bytes = max_disk_bytes
+        self._entries = OrderedDict()   # key -> {"model": json, "forecasts": {range: total}}
+        self._params = OrderedDict()    # warm_key -> warm_start_params()
+        self._files = OrderedDict()     # key -> size of {key}.json, least recently used first
+        self._bytes = 0
+        self._disk_bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+            self._scan()
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.json")
+
+    def _scan(self):
+        # Files left by earlier runs, oldest use first
+        files = []
+        for entry in os.scandir(self.cache_dir):
+            if entry.name.endswith(".json") and entry.is_file():
+                stat = entry.stat()
+                files.append((stat.st_mtime, entry.name[:-len(".json")], stat.st_size))
+        with self._lock:
+            for _, key, size in sorted(files):
+                self._files[key] = size
+                self._disk_bytes += size
+            self._evict_files()
+
+    def _evict_files(self):
+        while self._disk_bytes > self.max_disk_bytes and len(self._files) > 1:
+            key, size = self._files.popitem(last=False)
+            self._disk_bytes -= size
+            try:
+                os.remove(self._path(key))
+            except FileNotFoundError:
+                pass
+
+    def _touch_file(self, key):
+        with self._lock:
+            if key not in self._files:
+                return
+            self._files.move_to_end(key)
+        try:
+            os.utime(self._path(key))
+        except OSError:
+            pass
+
+    def _insert(self, key, entry):
+        old = self._entries.pop(key, None)
+        if old is not None:
+            self._bytes -= len(old["model"])
+        self._entries[key] = entry
+        self._bytes += len(entry["model"])
+
+        # Evict least recently used models until under the memory bound
+        while self._bytes > self.max_bytes and len(self._entries) > 1:
+            _, evicted = self._entries.popitem(last=False)
+            self._bytes -= len(evicted["model"])
+
+    def get(self, key):
+        """Cached entry for ``key`` (memory first, then disk) or None."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return {"model": entry["model"], "forecasts": dict(entry["forecasts"])}
+
+        if self.cache_dir and os.path.exists(self._path(key)):
+            try:
+                with open(self._path(key), encoding="utf-8") as f:
+                    entry = {"model": f.read(), "forecasts": {}}
+            except FileNotFoundError:
+                # Evicted since the exists() check
+                entry = None
+            if entry is not None:
+                with self._lock:
+                    self._insert(key, entry)
+                    self.hits += 1
+                self._touch_file(key)
+                return {"model": entry["model"], "forecasts": {}}
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put(self, key, model_json, forecasts):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry["model"] != model_json:
+                entry = {"model": model_json, "forecasts": {}}
+                self._insert(key, entry)
+            else:
+                self._entries.move_to_end(key)
+            entry["forecasts"].update(forecasts)
+
+        if self.cache_dir and not os.path.exists(self._path(key)):
+            tmp = f"{self._path(key)}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                f.write(model_json)
+            size = os.path.getsize(tmp)
+            os.replace(tmp, self._path(key))
+            with self._lock:
+                self._disk_bytes += size - self._files.pop(key, 0)
+                self._files[key] = size
+                self._evict_files()
+
+    def get_params(self, key):
+        with self._lock:
+            params = self._params.get(key)
+            if params is not None:
+                self._params.move_to_end(key)
+            return params
+
+    def put_params(self, key, params):
+        with self._lock:
+            self._params[key] = params
+            self._params.move_to_end(key)
+            while len(self._params) > self.max_params:
+                self._params.popitem(last=False)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "warm_params": len(self._params),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "disk_files": len(self._files),
+                "disk_bytes": self._disk_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+            }
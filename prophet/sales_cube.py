@@ -0,0 +1,137 @@
+"""Dense daily sales cube indexed by (retail entity, SKU, day).
+
+Built once per data snapshot from ``poc_retail``. Entities and SKUs are
+stored as categorical codes and ``sold_qty`` lives in one NumPy array, so
+the daily series of every SKU in a depot or distillery scope is a single
+vectorized sum over the entity axis instead of a DataFrame filter and
+``groupby("bill_date")`` per SKU.
+
+Days without any retail record are NaN (not 0) so a scope's series keeps
+exactly the dates that had records -- Prophet is trained on those points
+only, and the ">= 5 points" rule counts them.
+"""
+import numpy as np
+import pandas as pd
+
+
+class SalesWindow:
+    """Per-SKU daily totals of one scope over one date range."""
+
+    def __init__(self, dates, skus, totals):
+        self.dates = dates
+        self.skus = skus
+        self.totals = totals    # (len(skus), len(dates)), NaN = no record
+        self._rows = {sku: i for i, sku in enumerate(skus)}
+
+    def series(self, brand, size):
+        row = self.totals[self._rows[(brand, size)]]
+        present = ~np.isnan(row)
+        return pd.DataFrame({"ds": self.dates[present], "y": row[present]})
+
+
+class SalesCube:
+
+    def __init__(self, retail):
+        entity_codes, self.entities = pd.factorize(retail["entity_code"], sort=False)
+        sku_codes, sku_uniques = pd.MultiIndex.from_arrays(
+            [retail["brand_name"], retail["package_size"]]
+        ).factorize()
+        self.skus = list(sku_uniques)
+        self.entity_index = {code: i for i, code in enumerate(self.entities)}
+        self.sku_index = {sku: i for i, sku in enumerate(self.skus)}
+
+        n_entities, n_skus = len(self.entities), len(self.skus)
+        has_sku = sku_codes >= 0
+
+        # First row at which each (entity, SKU) appears -- keeps the SKU
+        # order of drop_duplicates() on the scope's rows.
+        self.first_seen = np.full((n_entities, n_skus), np.iinfo(np.int64).max, dtype=np.int64)
+        np.minimum.at(
+            self.first_seen,
+            (entity_codes[has_sku], sku_codes[has_sku]),
+            np.flatnonzero(has_sku)
+        )
+
+        dated = retail["bill_date"].notna().to_numpy() & has_sku
+        if dated.any():
+            self.start = retail["bill_date"][dated].min().normalize()
+            day_codes = (retail["bill_date"][dated].dt.normalize() - self.start).dt.days.to_numpy()
+            n_days = int(day_codes.max()) + 1
+        else:
+            self.start = pd.NaT
+            day_codes = np.empty(0, dtype=np.int64)
+            n_days = 0
+        self.dates = pd.date_range(self.start, periods=n_days) if n_days else pd.DatetimeIndex([])
+
+        # Last sale day per entity (-1 = no dated rows)
+        self.last_day = np.full(n_entities, -1, dtype=np.int64)
+        np.maximum.at(self.last_day, entity_codes[dated], day_codes)
+
+        # Aggregate duplicate (entity, SKU, day) rows, then scatter into the cube
+        flat = (entity_codes[dated] * n_skus + sku_codes[dated]) * n_days + day_codes
+        cells, inverse = np.unique(flat, return_inverse=True)
+        sums = np.bincount(inverse, weights=retail["sold_qty"].fillna(0).to_numpy()[dated], minlength=len(cells))
+
+        self.values = np.full((n_entities, n_skus, n_days), np.nan, dtype=np.float32)
+        self.values.reshape(-1)[cells] = sums
+
+    # ---------------------------------------------------------
+    # SCOPE QUERIES
+    # ---------------------------------------------------------
+    def positions(self, entity_codes):
+        """Cube rows of the given entities that have any retail records."""
+        index = self.entity_index
+        return np.array([index[c] for c in entity_codes if c in index], dtype=np.int64)
+
+    def skus_for(self, positions):
+        """SKUs sold by the scope, in order of first appearance."""
+        if len(positions) == 0:
+            return []
+        first = self.first_seen[positions].min(axis=0)
+        sold = np.flatnonzero(first != np.iinfo(np.int64).max)
+        return [self.skus[i] for i in sold[np.argsort(first[sold], kind="stable")]]
+
+    def last_date(self, positions):
+        last = self.last_day[positions].max() if len(positions) else -1
+        return self.dates[last] if last >= 0 else pd.NaT
+
+    def _days(self, start, end):
+        """Cube day range [lo, hi) of start <= day <= end."""
+        lo, hi = 0, len(self.dates)
+        if hi:
+            lo = max(int((pd.Timestamp(start) - self.start).days), 0)
+            hi = min(int((pd.Timestamp(end).normalize() - self.start).days) + 1, hi)
+        return lo, hi
+
+    def window(self, positions, skus, start, end):
+        """Daily totals of ``skus`` over the scope for start <= day <= end."""
+        lo, hi = self._days(start, end)
+        if hi <= lo:
+            return SalesWindow(self.dates[:0], skus, np.empty((len(skus), 0)))
+
+        sku_rows = np.array([self.sku_index[sku] for sku in skus], dtype=np.int64)
+        block = self.values[np.ix_(positions, sku_rows, np.arange(lo, hi))]
+
+        present = ~np.isnan(block).all(axis=0)
+        totals = np.nansum(block, axis=0, dtype=np.float64)
+        totals[~present] = np.nan
+        return SalesWindow(self.dates[lo:hi], skus, totals)
+
+    def group_totals(self, position_groups, skus, start, end):
+        """Sales of ``skus`` from start to end summed over each group of
+        cube rows: a (len(skus), len(position_groups)) array."""
+        totals = np.zeros((len(skus), len(position_groups)))
+        lo, hi = self._days(start, end)
+        sizes = [len(positions) for positions in position_groups]
+        if hi <= lo or not sum(sizes) or not skus:
+            return totals
+
+        # A day slice with one fancy index copies far faster than np.ix_;
+        # the copy is ours, so fmax can zero its NaNs in place
+        positions = np.concatenate(position_groups).astype(np.int64)
+        block = self.values[positions, :, lo:hi]
+        np.fmax(block, 0, out=block)
+        sku_rows = np.array([self.sku_index[sku] for sku in skus], dtype=np.int64)
+        shop_totals = block.sum(axis=2, dtype=np.float64)[:, sku_rows]
+        np.add.at(totals.T, np.repeat(np.arange(len(position_groups)), sizes), shop_totals)
+        return totals
@@ -0,0 +1,423 @@
+"""Turns a depot / distillery / intent request into per-SKU forecast work.
+
+``plan_depot`` and ``plan_distillery`` resolve the scope through the
+hierarchy index, slice every SKU's training series out of the sales cube,
+look up closing stock, and return a ``ForecastPlan``. The plan's ``jobs``
+go to ``ForecastExecutor.forecast`` (alone, or together with the jobs of
+other plans in a batch) and ``results`` turns the demands back into the
+JSON rows each route returns.
+
+Modes:
+- "direct" (default): one series per SKU over all shops in the scope.
+- "hierarchical": the base series are depot x SKU over each depot's
+  primary shops (see hierarchy.py). A depot forecasts its own base series;
+  a distillery's demand is the bottom-up sum of its depots' base
+  forecasts. Base series have the same model-cache keys in every route,
+  so a network refresh fits each of them once.
+
+A request's ``horizon`` (months to forecast from from_month) replaces the
+route's default of 1 or 2 months; rows then also carry a "months"
+breakdown of demand and quantity to raise per forecast month.
+
+The forecast ``profile`` (see forecasting.PROFILES) configures the Prophet
+models and is part of their cache keys. With "full-intervals" every job
+also forecasts the bounds of its total over all predict months, and rows
+carry "demand_lower" / "demand_upper"; a hierarchical plan adds up the
+bounds of its parts, which widens the interval.
+
+``allocate`` on a distillery or intent plan adds the split of each SKU's
+quantity across its depots (see allocation.py).
+"""
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from allocation import depot_allocation
+from forecasting import DEFAULT_PROFILE, PROFILES, total_demand
+from model_cache import series_key, warm_key
+
+
+class ScopeError(Exception):
+
+    def __init__(self, message, status=404):
+        super().__init__(message)
+        self.message = message
+        self.status = status
+
+
+def month_ranges(year, from_month, count):
+    """(first day, last day) of ``count`` consecutive months from from_month."""
+    ranges = []
+    predict_year = year
+    predict_month = from_month
+
+    for _ in range(count):
+        start = datetime(predict_year, predict_month, 1)
+        end = start + pd.offsets.MonthEnd(1)
+        ranges.append((start, end))
+
+        # Move to next month
+        predict_month += 1
+        if predict_month > 12:
+            predict_month = 1
+            predict_year += 1
+    return ranges
+
+
+def training_window(year, from_month, months):
+    """The ``months`` whole months before from_month."""
+    train_start_month = from_month - months
+    train_end_month = from_month - 1
+
+    train_start = datetime(year, train_start_month, 1)
+    train_end = datetime(year, train_end_month, 1) + pd.offsets.MonthEnd(1)
+    return train_start, train_end
+
+
+MODES = ("direct", "hierarchical")
+
+
+class PlanPart:
+    """Training series of every plan SKU summed over one group of shops."""
+
+    def __init__(self, label, shops, window, series, keys, warm_keys):
+        self.label = label              # depot id for hierarchical parts
+        self.shops = shops
+        self.window = window            # sales_cube.SalesWindow of all SKUs
+        self.series = series
+        self.keys = keys
+        self.warm_keys = warm_keys
+
+
+class ForecastPlan:
+
+    def __init__(self, skus, parts, train_start, train_end, predict_ranges,
+                 stock_by_sku, make_row, raise_field, breakdown=False, profile=DEFAULT_PROFILE,
+                 allocation=None):
+        self.skus = skus
+        self.parts = parts              # a SKU's demand is the sum over parts
+        self.train_start = train_start
+        self.train_end = train_end
+        self.predict_ranges = predict_ranges
+        self.stock_by_sku = stock_by_sku
+        self.make_row = make_row
+        self.raise_field = raise_field
+        self.breakdown = breakdown      # add the per-month "months" to rows
+        self.profile = profile
+        self.intervals = PROFILES[profile]["intervals"]
+        self.allocation = allocation    # allocation.DepotAllocation or None
+
+    @property
+    def job_ranges(self):
+        """predict_ranges, then the interval bounds of their total when the
+        profile has intervals."""
+        if not self.intervals:
+            return self.predict_ranges
+        start, end = self.predict_ranges[0][0], self.predict_ranges[-1][1]
+        return [*self.predict_ranges, ("lower", start, end), ("upper", start, end)]
+
+    @property
+    def jobs(self):
+        job_ranges = self.job_ranges
+        return [
+            (sku_df, job_ranges, key, warm, self.profile)
+            for part in self.parts
+            for sku_df, key, warm in zip(part.series, part.keys, part.warm_keys)
+        ]
+
+    def part_demands(self, job_demands):
+        """Split demands of ``jobs`` into one list per part."""
+        n = len(self.skus)
+        return [job_demands[i * n:(i + 1) * n] for i in range(len(self.parts))]
+
+    def sku_demands(self, part_demands):
+        """Bottom-up total per SKU of the per-part demands."""
+        return [sum(demands) for demands in zip(*part_demands)] if part_demands \
+            else [0.0] * len(self.skus)
+
+    def sku_demands_iter(self, job_totals):
+        """Yield (SKU index, demand, forecast per job range, demand per
+        part) from (job index, forecast per job range) pairs in any order,
+        as soon as every part of the SKU is known."""
+        n = len(self.skus)
+        months = len(self.predict_ranges)
+        if not self.parts:
+            zeros = [0.0] * len(self.job_ranges)
+            yield from ((i, 0.0, zeros, []) for i in range(n))
+            return
+
+        known = [[None] * len(self.parts) for _ in range(n)]
+        waiting = [len(self.parts)] * n
+        for job, totals in job_totals:
+            part, sku = divmod(job, n)
+            known[sku][part] = totals
+            waiting[sku] -= 1
+            if waiting[sku] == 0:
+                part_demands = [total_demand(part_totals[:months]) for part_totals in known[sku]]
+                yield sku, sum(part_demands), np.sum(known[sku], axis=0), part_demands
+
+    def row(self, index, demand, range_totals=None, part_demands=None):
+        brand, size = self.skus[index]
+        row = self.make_row(brand, size, demand, self.stock_by_sku[(brand, size)])
+        if range_totals is not None:
+            self._add_details([row], [range_totals])
+        if self.allocation is not None and part_demands is not None:
+            self.allocation.add([row], np.reshape(part_demands, (-1, 1)), [index])
+        return row
+
+    def results(self, job_totals):
+        """Rows of every SKU from the forecast per job range of each of
+        ``jobs``."""
+        months = len(self.predict_ranges)
+        part_totals = self.part_demands(job_totals)
+        part_demands = [
+            [total_demand(totals[:months]) for totals in part] for part in part_totals
+        ]
+        demands = self.sku_demands(part_demands)
+        rows = [self.make_row(brand, size, demand, self.stock_by_sku[(brand, size)])
+                for (brand, size), demand in zip(self.skus, demands)]
+
+        if rows:
+            range_totals = np.sum(part_totals, axis=0) if part_totals \
+                else np.zeros((len(self.skus), len(self.job_ranges)))
+            self._add_details(rows, range_totals)
+            if self.allocation is not None:
+                self.allocation.add(rows, part_demands)
+        return rows
+
+    def _add_details(self, rows, range_totals):
+        """"months" breakdown and interval bounds from each row's forecast
+        per job range (NumPy engines have no bounds)."""
+        range_totals = np.asarray(range_totals, dtype=float).reshape(len(rows), -1)
+        months = len(self.predict_ranges)
+        if self.breakdown:
+            self._add_months(rows, range_totals[:, :months])
+        if self.intervals and range_totals.shape[1] > months:
+            for row, (lower, upper) in zip(rows, np.rint(range_totals[:, months:]).astype(int)):
+                row["demand_lower"], row["demand_upper"] = int(lower), int(upper)
+
+    def _add_months(self, rows, month_totals):
+        """Demand and quantity to raise per forecast month; remaining stock
+        covers the earliest months first. The running totals are rounded
+        and the last one is the row's own figure, so the months add up to
+        the row's demand and quantity exactly."""
+        month_totals = np.asarray(month_totals, dtype=float).reshape(len(rows), -1)
+        stock = np.array([row["remaining_stock"] for row in rows], dtype=float)[:, None]
+        cumulative = np.cumsum(month_totals, axis=1)
+        short = np.maximum(cumulative - stock, 0.0)
+
+        cumulative = np.rint(cumulative).astype(np.int64)
+        short = np.rint(short).astype(np.int64)
+        cumulative[:, -1] = [row["demand"] for row in rows]
+        short[:, -1] = [row[self.raise_field] for row in rows]
+
+        labels = [start.strftime("%Y-%m") for start, _ in self.predict_ranges]
+        demands = np.diff(cumulative, axis=1, prepend=0).tolist()
+        raises = np.diff(short, axis=1, prepend=0).tolist()
+        for row, row_demands, row_raises in zip(rows, demands, raises):
+            row["months"] = [
+                {"month": label, "demand": demand, self.raise_field: qty}
+                for label, demand, qty in zip(labels, row_demands, row_raises)
+            ]
+
+
+def _plan_part(snapshot, label, shops, skus, train_start, train_end, profile):
+    positions = snapshot.sales.positions(shops)
+    window = snapshot.sales.window(positions, skus, train_start, train_end)
+    series = [window.series(brand, size) for brand, size in skus]
+    keys = [series_key(snapshot.version, shops, sku, train_start, train_end, profile)
+            for sku in skus]
+    warm_keys = [warm_key(shops, sku) for sku in skus]
+    return PlanPart(label, shops, window, series, keys, warm_keys)
+
+
+# ---------------------------------------------------------
+# DEPOT
+# ---------------------------------------------------------
+def depot_row(brand, size, demand, sku_stock):
+    depot_stock = sku_stock["remaining_at_depot"]
+    retail_stock_amt = sku_stock["remaining_at_retail"]
+
+    remaining_stock = int(depot_stock + retail_stock_amt)
+
+    # QUANTITY TO RAISE
+    qty_to_raise = max(demand - remaining_stock, 0)
+    quantitytoraise = int(round(qty_to_raise))
+    rounddemand = int(round(demand))
+
+    return {
+        "brand": str(brand),
+        "package_size": str(size),
+        "remaining_at_depot": int(depot_stock),
+        "remaining_at_retail": int(retail_stock_amt),
+        "demand": int(rounddemand),
+        "remaining_stock": remaining_stock,
+        "quantitytoraise": quantitytoraise
+    }
+
+
+def plan_depot(snapshot, depotid, from_month, months, mode="direct", horizon=None,
+               profile=DEFAULT_PROFILE, allocate=False):
+    sales = snapshot.sales
+
+    if allocate:
+        raise ScopeError("allocate needs a distillery or intent scope", 400)
+
+    # 1️⃣ RETAIL SHOPS UNDER DEPOT (hierarchical: only its primary shops)
+    if mode == "hierarchical":
+        retail_shops = list(snapshot.hierarchy.base_shops_for_depot(depotid))
+    else:
+        retail_shops = list(snapshot.hierarchy.shops_for_depot(depotid))
+
+    if len(retail_shops) == 0:
+        if mode == "hierarchical" and snapshot.hierarchy.shops_for_depot(depotid):
+            raise ScopeError("No retail shops have this depot as their primary depot")
+        raise ScopeError("No retail shops found for this depot")
+
+    # 2️⃣ FULL SALES DATA (rows of the sales cube)
+    shop_positions = sales.positions(retail_shops)
+
+    if len(shop_positions) == 0:
+        raise ScopeError("No retail sales found for this depot")
+
+    # Determine prediction year dynamically (using latest year in data)
+    year = sales.last_date(shop_positions).year
+
+    # 3️⃣ BUILD TRAINING WINDOW BASED ON from_month & months
+    train_start, train_end = training_window(year, from_month, months)
+
+    # ALL SKUs handled by depot, with their training series
+    all_skus = sales.skus_for(shop_positions)
+    parts = [_plan_part(snapshot, depotid, retail_shops, all_skus, train_start, train_end,
+                        profile)]
+
+    # Closing stock of every SKU at the depot and its retail shops
+    stock_by_sku = snapshot.stock_index.remaining({
+        "remaining_at_depot": [depotid],
+        "remaining_at_retail": retail_shops
+    }, all_skus)
+
+    # 4️⃣ FORECAST NEXT MONTH → from_month (or ``horizon`` months)
+    return ForecastPlan(
+        all_skus, parts, train_start, train_end,
+        month_ranges(year, from_month, horizon or 1), stock_by_sku, depot_row,
+        "quantitytoraise", breakdown=horizon is not None, profile=profile
+    )
+
+
+# ---------------------------------------------------------
+# DISTILLERY / INTENT
+# ---------------------------------------------------------
+def distillery_row(raise_field):
+    def make_row(brand, size, demand, sku_stock):
+        remaining_at_distillery = sku_stock["remaining_at_distillery"]
+        remaining_at_depot = sku_stock["remaining_at_depot"]
+        remaining_at_retail = sku_stock["remaining_at_retail"]
+
+        remaining_stock = (
+            remaining_at_distillery +
+            remaining_at_depot +
+            remaining_at_retail
+        )
+
+        quantitytoraise = int(round(max(demand - remaining_stock, 0)))
+
+        return {
+            "brand": str(brand),
+            "package_size": str(size),
+            "demand": int(round(demand)),
+            "remaining_at_distillery": remaining_at_distillery,
+            "remaining_at_depot": remaining_at_depot,
+            "remaining_at_retail": remaining_at_retail,
+            "remaining_stock": remaining_stock,
+            raise_field: quantitytoraise
+        }
+    return make_row
+
+
+def plan_distillery(snapshot, distillery_id, from_month, months,
+                    predict_months, raise_field, mode="direct", horizon=None,
+                    profile=DEFAULT_PROFILE, allocate=False):
+    """Distillery-wide plan; the distillery route forecasts 2 months and
+    reports "quantityToManufacture", the intent route 1 month and
+    "quantitytoraise". ``horizon`` overrides ``predict_months``;
+    ``allocate`` splits the quantity across the depots."""
+    sales = snapshot.sales
+
+    # 1️⃣ FIND ALL DEPOTS UNDER THIS DISTILLERY
+    depots = list(snapshot.hierarchy.depots_for_distillery(distillery_id))
+
+    if len(depots) == 0:
+        raise ScopeError("No depots found under this distillery")
+
+    # 2️⃣ FIND RETAIL SHOPS UNDER THOSE DEPOTS
+    retail_shops = list(snapshot.hierarchy.shops_for_distillery(distillery_id))
+
+    # 3️⃣ SALES OF THOSE RETAIL SHOPS
+    shop_positions = sales.positions(retail_shops)
+
+    if len(shop_positions) == 0:
+        raise ScopeError("No retail sales found for this distillery")
+
+    year = sales.last_date(shop_positions).year
+
+    # 4️⃣ DEFINE TRAINING WINDOW
+    train_start, train_end = training_window(year, from_month, months)
+
+    # ALL SKUs produced by this distillery (via depots)
+    all_skus = sales.skus_for(shop_positions)
+
+    if mode == "hierarchical":
+        # One base series per depot over its primary shops, summed bottom-up
+        parts = []
+        for depot in depots:
+            base_shops = list(snapshot.hierarchy.base_shops_for_depot(depot))
+            if base_shops:
+                parts.append(_plan_part(
+                    snapshot, depot, base_shops, all_skus, train_start, train_end, profile
+                ))
+    else:
+        parts = [_plan_part(
+            snapshot, distillery_id, retail_shops, all_skus, train_start, train_end, profile
+        )]
+
+    # Closing stock of every SKU at each level of the chain
+    stock_by_sku = snapshot.stock_index.remaining({
+        "remaining_at_distillery": [distillery_id],
+        "remaining_at_depot": depots,
+        "remaining_at_retail": retail_shops
+    }, all_skus)
+
+    allocation = None
+    if allocate:
+        allocation = depot_allocation(
+            snapshot, depots, all_skus, train_start, train_end, raise_field,
+            parts if mode == "hierarchical" else None
+        )
+
+    return ForecastPlan(
+        all_skus, parts, train_start, train_end,
+        month_ranges(year, from_month, horizon or predict_months),
+        stock_by_sku, distillery_row(raise_field), raise_field,
+        breakdown=horizon is not None, profile=profile, allocation=allocation
+    )
+
+
+def distillery_planner(predict_months, raise_field):
+    def plan(snapshot, distillery_id, from_month, months, mode="direct", horizon=None,
+             profile=DEFAULT_PROFILE, allocate=False):
+        return plan_distillery(snapshot, distillery_id, from_month, months, predict_months,
+                               raise_field, mode, horizon, profile, allocate)
+    return plan
+
+
+# Route scope -> plan builder taking (snapshot, id, from_month, months,
+# mode, horizon, profile, allocate)
+PLANNERS = {
+    "depot": plan_depot,
+    "distillery": distillery_planner(2, "quantityToManufacture"),
+    "intent": distillery_planner(1, "quantitytoraise"),
+}
+
+MAX_HORIZON = 12
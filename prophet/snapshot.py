@@ -0,0 +1,33 @@
+"""Converts the CSV files or the MySQL tables into the Parquet snapshot.
+
+    python snapshot.py --from csv [--out data/snapshot]
+    python snapshot.py --from mysql
+
+Then start the service with PROPHET_DATA_SOURCE=parquet (and
+PROPHET_SNAPSHOT_DIR if --out was given). Only the columns the service
+uses are written, with codes, brands and sizes as categoricals.
+"""
+import argparse
+import time
+
+from datastore import SNAPSHOT_DIR, make_source, write_snapshot
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--from", dest="source", choices=("csv", "mysql"), default="csv",
+                        help="data source to convert")
+    parser.add_argument("--out", default=SNAPSHOT_DIR, help="snapshot directory")
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    tables = make_source(args.source).load()
+    write_snapshot(tables, args.out)
+
+    for name, frame in tables.items():
+        print(f"{name:<12}{len(frame):>12} rows{frame.memory_usage(deep=True).sum() / 2**20:>10.1f} MB")
+    print(f"wrote {args.out} in {time.perf_counter() - started:.2f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,179 @@
+"""Synthetic POC tables at any scale, for benchmarks and load tests.
+
+    python synthetic.py --out /tmp/poc --shops 2000 --skus 200 [--days 270]
+
+writes poc_retail.csv, poc_wholesale.csv, poc_stock_closing.csv and
+poc_distillery.csv with the same columns as the files in data/, so the
+service can be pointed at them with PROPHET_DATA_DIR. Every shop has a
+primary depot (and sometimes a second one), every depot one distillery,
+and each shop sells a random subset of the SKUs with weekly seasonality,
+a trend and missing days. The same arguments and --seed give the same
+files.
+"""
+import argparse
+import os
+
+import numpy as np
+import pandas as pd
+
+
+SIZES = ("90", "180", "375", "750", "1000")
+PACKAGE_TYPES = ("Pet Bottle", "Glass Bottle")
+
+
+def entities(distilleries, depots, shops):
+    distillery_codes = [f"BOTTELING{900000 + i}" for i in range(distilleries)]
+    depot_codes = [f"DEPOSYN{i:04d}" for i in range(depots)]
+    shop_codes = [str(30000000 + i) for i in range(shops)]
+    return distillery_codes, depot_codes, shop_codes
+
+
+def make_tables(distilleries=2, depots=20, shops=500, skus=50, skus_per_shop=20,
+                days=180, start="2025-01-01", second_depot=0.1, missing=0.15, seed=0):
+    rng = np.random.default_rng(seed)
+    distillery_codes, depot_codes, shop_codes = entities(distilleries, depots, shops)
+    dates = pd.date_range(start, periods=days)
+
+    brands = np.array([f"Synthetic Brand {i // len(SIZES):03d}" for i in range(skus)])
+    sizes = np.array([SIZES[i % len(SIZES)] for i in range(skus)])
+    etins = np.array([f"SYNETIN{i:08d}" for i in range(skus)])
+    package_types = np.array([PACKAGE_TYPES[i % 2] for i in range(skus)])
+
+    # Network: depot -> distillery, shop -> primary (and maybe second) depot
+    depot_distillery = np.arange(depots) % distilleries
+    primary = rng.integers(0, depots, shops)
+    second = np.where(rng.random(shops) < second_depot, rng.integers(0, depots, shops), -1)
+
+    # Retail: every shop sells skus_per_shop SKUs on most days
+    per_shop = min(skus_per_shop, skus)
+    shop_skus = np.argsort(rng.random((shops, skus)), axis=1)[:, :per_shop]
+    shop_idx = np.repeat(np.arange(shops), per_shop)
+    sku_idx = shop_skus.reshape(-1)
+
+    base = rng.gamma(2.0, 10.0, len(sku_idx))
+    trend = rng.normal(0.0, 0.002, len(sku_idx))
+    weekly = 1 + 0.3 * np.sin(2 * np.pi * (np.arange(days) % 7) / 7)
+    rate = base[:, None] * weekly[None, :] * (1 + trend[:, None] * np.arange(days)[None, :])
+    qty = rng.poisson(np.clip(rate, 0.1, None))
+    present = rng.random(qty.shape) >= missing
+
+    series, day = np.nonzero(present)
+    retail = pd.DataFrame({
+        "entity_code": np.array(shop_codes)[shop_idx[series]],
+        "entity_name": "Synthetic Shop",
+        "license_number": "RETAIL" + pd.Series(np.array(shop_codes)[shop_idx[series]]),
+        "bill_date": dates[day].strftime("%Y-%m-%d"),
+        "etin": etins[sku_idx[series]],
+        "brand_name": brands[sku_idx[series]],
+        "package_size": sizes[sku_idx[series]],
+        "package_type": package_types[sku_idx[series]],
+        "Plan Id": "SYNTHETIC_PLAN",
+        "sold_qty": qty[series, day],
+    })
+
+    # Wholesale: each depot -> shop link gets a few dispatches of its SKUs
+    links = [(primary[s], s, 3) for s in range(shops)] + \
+            [(second[s], s, 1) for s in range(shops) if second[s] >= 0]
+    rows = []
+    for depot, shop, dispatches in links:
+        for sku in shop_skus[shop][:dispatches]:
+            rows.append((depot_codes[depot], shop_codes[shop], sku,
+                         dates[rng.integers(0, days)], int(rng.integers(1, 100)) * 45))
+    wholesale = dispatch_frame(rows, brands, sizes, etins, package_types)
+
+    # Distillery: each distillery -> depot link gets one dispatch per SKU
+    rows = [
+        (distillery_codes[depot_distillery[depot]], depot_codes[depot], sku,
+         dates[rng.integers(0, days)], int(rng.integers(10, 500)) * 45)
+        for depot in range(depots)
+        for sku in rng.choice(skus, min(10, skus), replace=False)
+    ]
+    distillery = dispatch_frame(rows, brands, sizes, etins, package_types)
+
+    # Closing stock on the last day for every entity and some of its SKUs
+    codes = distillery_codes + depot_codes + shop_codes
+    stock_codes = np.repeat(codes, 3)
+    stock_skus = rng.integers(0, skus, len(stock_codes))
+    stock = pd.DataFrame({
+        "entity_code": stock_codes,
+        "entity_name": "Synthetic Entity",
+        "license_number": "SYN" + pd.Series(stock_codes),
+        "stock_date": dates[-1].strftime("%Y-%m-%d"),
+        "brand_name": brands[stock_skus],
+        "package_type": package_types[stock_skus],
+        "package_size": sizes[stock_skus],
+        "etin": etins[stock_skus],
+        "closed_qty": rng.integers(0, 500, len(stock_codes)),
+    })
+
+    return {"retail": retail, "wholesale": wholesale, "stock": stock, "distillery": distillery}
+
+
+def dispatch_frame(rows, brands, sizes, etins, package_types):
+    from_codes, to_codes, sku, dispatch_dates, bottles = (list(col) for col in zip(*rows))
+    sku = np.array(sku)
+    bottles = np.array(bottles)
+    return pd.DataFrame({
+        "indent_number": "SYNTHETIC_INDENT",
+        "bottling_plan_id": "SYNTHETIC_PLAN",
+        "plan_created_date": pd.DatetimeIndex(dispatch_dates).strftime("%Y-%m-%d"),
+        "etin": etins[sku],
+        "code_type": "UnMapped",
+        "dispatch_date": pd.DatetimeIndex(dispatch_dates).strftime("%Y-%m-%d"),
+        "tp_reference_number": "SYNTHETIC_TP",
+        "from_entity_code": from_codes,
+        "from_entity_name": "Synthetic Sender",
+        "to_entity_code": to_codes,
+        "to_entity_name": "Synthetic Receiver",
+        "brand_name": brands[sku],
+        "package_size": sizes[sku],
+        "package_type": package_types[sku],
+        "dispatched_cases": bottles // 45,
+        "dispatched_bottles": bottles,
+    })
+
+
+def write_tables(tables, out_dir):
+    # Imported here: datastore reads PROPHET_DATA_DIR at import time and
+    # benchmark.py sets it only after parsing its arguments
+    from datastore import TABLES
+
+    os.makedirs(out_dir, exist_ok=True)
+    for name, frame in tables.items():
+        frame.index = pd.RangeIndex(1, len(frame) + 1, name="#")
+        frame.to_csv(os.path.join(out_dir, f"{TABLES[name][0]}.csv"))
+
+
+def add_arguments(parser):
+    parser.add_argument("--distilleries", type=int, default=2)
+    parser.add_argument("--depots", type=int, default=20)
+    parser.add_argument("--shops", type=int, default=500)
+    parser.add_argument("--skus", type=int, default=50)
+    parser.add_argument("--skus-per-shop", type=int, default=20)
+    parser.add_argument("--days", type=int, default=180)
+    parser.add_argument("--start", default="2025-01-01")
+    parser.add_argument("--seed", type=int, default=0)
+
+
+def scale(args):
+    return {
+        "distilleries": args.distilleries, "depots": args.depots, "shops": args.shops,
+        "skus": args.skus, "skus_per_shop": args.skus_per_shop, "days": args.days,
+        "start": args.start, "seed": args.seed,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--out", required=True, help="directory for the CSV files")
+    add_arguments(parser)
+    args = parser.parse_args()
+
+    tables = make_tables(**scale(args))
+    write_tables(tables, args.out)
+    for name, frame in tables.items():
+        print(f"{name:<12}{len(frame):>12} rows")
+
+
+if __name__ == "__main__":
+    main()
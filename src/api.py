@@ -1,14 +1,20 @@
-from flask import Flask, request, jsonify,send_file
+from flask import Flask, Response, request, jsonify,send_file
 from dotenv import load_dotenv
 from langchain_core.messages import AIMessage, HumanMessage
 from langchain_openai import ChatOpenAI
 from langchain_community.utilities import SQLDatabase
 import os
-from sqlalchemy import create_engine, text
+from sqlalchemy import create_engine, inspect, text
 from flask_cors import CORS
 from openai import OpenAI
 import tempfile
 import base64
+import json
+import time
+
+from conversations import ConversationStore, chat_loader
+from result_cache import ResultCache, read_data_version
+from sql_cache import SQLCache, fingerprint
 
 
 
@@ -24,25 +30,36 @@ raw_engine = create_engine(
     pool_pre_ping=True
 )
 
+# The *_chat(conn, ...) helpers take a connection so the async server
+# (api_async.py) can run them on its own pool via run_sync
+def insert_chat(conn, usercode, role, message=None, response=None, audio_blob=None):
+    query = text("""
+        INSERT INTO chat_history (usercode, role, message, audio, response)
+        VALUES (:usercode, :role, :message, :audio, :response)
+    """)
+    conn.execute(query, {
+        "usercode": usercode,
+        "role": role,
+        "message": message,
+        "audio": audio_blob,
+        "response": response
+    })
+
+
 def save_chat(usercode, role, message=None, response=None, audio_blob=None):
     try:
-        query = text("""
-            INSERT INTO chat_history (usercode, role, message, audio, response)
-            VALUES (:usercode, :role, :message, :audio, :response)
-        """)
         with raw_engine.begin() as conn:
-            conn.execute(query, {
-                "usercode": usercode,
-                "role": role,
-                "message": message,
-                "audio": audio_blob,
-                "response": response
-            })
+            insert_chat(conn, usercode, role, message, response, audio_blob)
     except Exception as e:
         print("Chat save error:", e)
 
 
 def get_chat_by_usercode(usercode):
+    with raw_engine.begin() as conn:
+        return select_chat(conn, usercode)
+
+
+def select_chat(conn, usercode):
     query = text("""
         SELECT role, message, audio, response, created_at
         FROM chat_history
@@ -50,8 +67,7 @@ def get_chat_by_usercode(usercode):
         ORDER BY id ASC
     """)
 
-    with raw_engine.begin() as conn:
-        rows = conn.execute(query, {"usercode": usercode}).mappings().all()
+    rows = conn.execute(query, {"usercode": usercode}).mappings().all()
 
 
     result = []
@@ -88,7 +104,12 @@ def init_database():
         "max_overflow": 40
     }
 
-    return SQLDatabase.from_uri(db_uri, engine_args=engine_args)
+    # Bookkeeping tables stay out of the schema the LLM sees
+    # (SQLDatabase rejects ignore_tables that do not exist)
+    tables = inspect(raw_engine)
+    ignore_tables = [table for table in ("data_version",) if tables.has_table(table)]
+
+    return SQLDatabase.from_uri(db_uri, engine_args=engine_args, ignore_tables=ignore_tables)
 
 db = init_database()
 
@@ -98,12 +119,13 @@ SCHEMA = db.get_table_info()
 #print("Database schema cached.",SCHEMA)
 
 
-SYSTEM_SQL_ANALYST = f"""
+def sql_analyst_prompt(schema):
+    return f"""
 You are an expert MySQL analyst.
 You know the following database schema:
 
 <SCHEMA>
-{SCHEMA}
+{schema}
 </SCHEMA>
 
 BUSINESS FLOW:
@@ -162,6 +184,9 @@ SQL RULES:
 """
 
 
+SYSTEM_SQL_ANALYST = sql_analyst_prompt(SCHEMA)
+
+
 
 
 SYSTEM_DATA_ANALYST = """
@@ -184,6 +209,127 @@ llm_answer = ChatOpenAI(model="gpt-4.1-mini", temperature=0)
 
 
 
+# =====================================================================
+# 3b. QUESTION -> SQL AND RESULT CACHES
+# =====================================================================
+# Repeated (or near-identical) questions reuse the SQL generated for them
+# before; the cache is emptied when the table structure changes, which is
+# checked at most every SCHEMA_CHECK_SECONDS
+
+EMBEDDING_MODEL = os.getenv("SQL_CACHE_EMBEDDING_MODEL", "text-embedding-3-small")
+SCHEMA_CHECK_SECONDS = float(os.getenv("SCHEMA_CHECK_SECONDS", "60"))
+DATA_VERSION_CHECK_SECONDS = float(os.getenv("DATA_VERSION_CHECK_SECONDS", "5"))
+
+
+def embed_question(question):
+    return client.embeddings.create(model=EMBEDDING_MODEL, input=question).data[0].embedding
+
+
+sql_cache = SQLCache(embed_question)
+schema_state = {"fingerprint": None, "checked": None}
+
+
+def read_schema_columns(conn):
+    query = text("""
+        SELECT table_name, column_name, column_type
+        FROM information_schema.columns
+        WHERE table_schema = DATABASE()
+        ORDER BY table_name, ordinal_position
+    """)
+    return [tuple(str(v) for v in r) for r in conn.execute(query).fetchall()]
+
+
+def schema_fingerprint(columns):
+    return fingerprint(*("\x1e".join(r) for r in columns))
+
+
+def columns_missing_from(schema, columns, tables):
+    """(table, column) of ``tables`` that the schema prompt does not show."""
+    return [(table, column) for table, column, _ in columns
+            if table in tables and column not in schema]
+
+
+def check_due(state, seconds):
+    now = time.monotonic()
+    if state["checked"] is not None and now - state["checked"] < seconds:
+        return False
+    state["checked"] = now
+    return True
+
+
+def schema_check_due():
+    return check_due(schema_state, SCHEMA_CHECK_SECONDS)
+
+
+def apply_schema(columns):
+    """Reload the schema prompt and empty the SQL cache if the tables changed.
+
+    SQLDatabase reflects the tables once, when it is built, so a changed
+    schema needs a new one before get_table_info() shows it.
+    """
+    global db, SCHEMA, SYSTEM_SQL_ANALYST
+
+    current = schema_fingerprint(columns)
+    if schema_state["fingerprint"] not in (None, current):
+        old_db, db = db, init_database()
+        old_db._engine.dispose()
+        SCHEMA = db.get_table_info()
+        SYSTEM_SQL_ANALYST = sql_analyst_prompt(SCHEMA)
+
+        missing = columns_missing_from(SCHEMA, columns, set(db.get_usable_table_names()))
+        if missing:
+            print("Schema reload error: columns missing from the prompt:", missing)
+    schema_state["fingerprint"] = current
+    sql_cache.check_fingerprint(fingerprint(current, llm_sql.model_name))
+
+
+def refresh_schema():
+    if not schema_check_due():
+        return
+
+    try:
+        with raw_engine.begin() as conn:
+            columns = read_schema_columns(conn)
+    except Exception as e:
+        print("Schema check error:", e)
+        return
+
+    apply_schema(columns)
+
+
+# Results of the SQL that ran, until the TTL passes or a loader bumps
+# data_version (see result_cache.py). The version is read at most every
+# DATA_VERSION_CHECK_SECONDS, so a cache hit costs no database round trip
+# and a load shows up within that many seconds
+result_cache = ResultCache()
+version_state = {"version": None, "checked": None}
+
+
+def data_version_due():
+    return check_due(version_state, DATA_VERSION_CHECK_SECONDS)
+
+
+def data_version():
+    if not data_version_due():
+        return version_state["version"]
+    try:
+        with raw_engine.begin() as conn:
+            version_state["version"] = read_data_version(conn)
+    except Exception as e:
+        print("Data version read error:", e)
+        version_state["version"] = None
+    return version_state["version"]
+
+
+def run_sql(sql):
+    version = data_version()
+    result = result_cache.get(sql, version)
+    if result is None:
+        result = db.run(sql)
+        result_cache.put(sql, version, result)
+    return result
+
+
 # =====================================================================
 # 4. SQL CLEANER
 # =====================================================================
@@ -196,17 +342,19 @@ def clean_sql(q):
 # 5. SQL GENERATION
 # =====================================================================
 
-def generate_sql(user_question: str, usercode: str,role: str):
+def sql_messages(user_question: str, usercode: str, role: str):
     system_prompt = SYSTEM_SQL_ANALYST \
         .replace("<USERCODE>", usercode) \
         .replace("<ROLE>", role)
 
-    messages = [
+    return [
         {"role": "system", "content": system_prompt},
         {"role": "user", "content": user_question},
     ]
 
-    sql = llm_sql.invoke(messages).content
+
+def generate_sql(user_question: str, usercode: str,role: str):
+    sql = llm_sql.invoke(sql_messages(user_question, usercode, role)).content
     return clean_sql(sql)
 
 
@@ -214,16 +362,21 @@ def generate_sql(user_question: str, usercode: str,role: str):
 # 6. FINAL ANSWER GENERATION
 # =====================================================================
 
-def generate_final_answer(question, sql_query, sql_results, chat_history):
+NOT_ALLOWED_ANSWER = "You do not have permission to access this information."
+
+
+def answer_messages(question, sql_query, sql_results, chat_history):
+    """Prompt for the final answer, or None when the result is a
+    permission block."""
 
     # Handle permission block
     if isinstance(sql_results, list) and len(sql_results) > 0:
         row = sql_results[0]
         if isinstance(row, dict) and row.get("message") == "NOT_ALLOWED":
-            return "You do not have permission to access this information."
+            return None
 
     print("SQL Results:", sql_query)
-    messages = [
+    return [
         {"role": "system", "content": SYSTEM_DATA_ANALYST},
         *chat_history,
         {
@@ -236,26 +389,62 @@ SQL Result: {sql_results}
         },
     ]
 
+
+def generate_final_answer(question, sql_query, sql_results, chat_history):
+    messages = answer_messages(question, sql_query, sql_results, chat_history)
+    if messages is None:
+        return NOT_ALLOWED_ANSWER
     return llm_answer.invoke(messages).content
 
 
+def stream_final_answer(question, sql_query, sql_results, chat_history):
+    """Yield the final answer in pieces as the model writes it."""
+    messages = answer_messages(question, sql_query, sql_results, chat_history)
+    if messages is None:
+        yield NOT_ALLOWED_ANSWER
+        return
+    for chunk in llm_answer.stream(messages):
+        if chunk.content:
+            yield chunk.content
+
+
 # =====================================================================
 # 7. MAIN PIPELINE
 # =====================================================================
 
-def process_query(user_query, usercode, role, chat_history):
+def query_stages(user_query, usercode, role):
+    """Yield ("sql", sql) once the SQL is known, then ("rows", result) --
+    or ("error", answer) if the SQL fails."""
 
-    sql = generate_sql(user_query, usercode, role)
+    refresh_schema()
+    sql = sql_cache.get(user_query, usercode, role)
+    cached = sql is not None
+    if not cached:
+        sql = generate_sql(user_query, usercode, role)
+    yield "sql", sql
 
     try:
-        sql_result = db.run(sql)
+        sql_result = run_sql(sql)
     except Exception as e:
-        return f"SQL Error: {e}\nGenerated SQL: {sql}"
+        yield "error", f"SQL Error: {e}\nGenerated SQL: {sql}"
+        return
+
+    # Only SQL that ran is worth reusing
+    if not cached:
+        sql_cache.put(user_query, usercode, role, sql)
+    yield "rows", sql_result
+
+
+def process_query(user_query, usercode, role, chat_history):
+
+    stages = dict(query_stages(user_query, usercode, role))
+    if "error" in stages:
+        return stages["error"]
 
     history_slice = chat_history[-2:]
 
     return generate_final_answer(
-        user_query, sql, sql_result, history_slice
+        user_query, stages["sql"], stages["rows"], history_slice
     )
 
 
@@ -263,10 +452,10 @@ def process_query(user_query, usercode, role, chat_history):
 # 8. FLASK API
 # =====================================================================
 
+# Each usercode's recent turns, bounded per user and in total; users not
+# in memory are reloaded from chat_history when they next ask
+conversations = ConversationStore(chat_loader(raw_engine))
 
-chat_history = [
-    AIMessage(content="Hello! I'm your SQL assistant. Ask me anything.")
-]
 
 @app.post("/analyze")
 def analyze():
@@ -279,14 +468,14 @@ def analyze():
     if not user_query:
         return jsonify({"error": "query field is required"}), 400
 
-    chat_history.append(HumanMessage(content=user_query))
+    chat_history = conversations.history(usercode) + [HumanMessage(content=user_query)]
 
     try:
         response = process_query(user_query, usercode, role, chat_history)
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
-    chat_history.append(AIMessage(content=response))
+    conversations.append(usercode, chat_history[-1], AIMessage(content=response))
     save_chat(usercode, "assistant", message=user_query, response=response)
 
     return jsonify({
@@ -297,6 +486,69 @@ def analyze():
 
 
 
+def sse(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+@app.post("/analyze/stream")
+def analyze_stream():
+    """/analyze as server-sent events: "sql" when the SQL is known, "rows"
+    when it has run, "token" for each piece of the answer, then "done"
+    with the same body /analyze returns (or "error")."""
+    data = request.json
+
+    user_query = data.get("query")
+    usercode = data.get("usercode", "")
+    role = data.get("role", "").lower().strip()
+
+    if not user_query:
+        return jsonify({"error": "query field is required"}), 400
+
+    chat_history = conversations.history(usercode) + [HumanMessage(content=user_query)]
+
+    def events():
+        try:
+            stages = {}
+            for stage, value in query_stages(user_query, usercode, role):
+                stages[stage] = value
+                if stage == "sql":
+                    yield sse("sql", {"sql": value})
+                elif stage == "rows":
+                    yield sse("rows", {"empty": value in ("", "[]")})
+
+            if "error" in stages:
+                response = stages["error"]
+                yield sse("token", {"text": response})
+            else:
+                pieces = []
+                for piece in stream_final_answer(
+                    user_query, stages["sql"], stages["rows"], chat_history[-2:]
+                ):
+                    pieces.append(piece)
+                    yield sse("token", {"text": piece})
+                response = "".join(pieces)
+        except Exception as e:
+            yield sse("error", {"error": str(e)})
+            return
+
+        conversations.append(usercode, chat_history[-1], AIMessage(content=response))
+        save_chat(usercode, "assistant", message=user_query, response=response)
+        yield sse("done", {"query": user_query, "usercode": usercode, "response": response})
+
+    # X-Accel-Buffering: nginx passes each event on at once
+    return Response(events(), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+@app.get("/analyze/cache")
+def analyze_cache():
+    return jsonify({
+        "sql": sql_cache.stats(),
+        "results": result_cache.stats(),
+        "conversations": conversations.stats(),
+    })
+
+
 @app.get("/analyze/history/<usercode>")
 def analyze_history(usercode):
     results = get_chat_by_usercode(usercode)
@@ -337,7 +589,9 @@ def voice_input():
         transcribed_text = transcript.text.strip()
 
         # AI reply
+        chat_history = conversations.history(usercode) + [HumanMessage(content=transcribed_text)]
         reply = process_query(transcribed_text, usercode, role, chat_history)
+        conversations.append(usercode, chat_history[-1], AIMessage(content=reply))
 
         # Save to DB (text + audio)
         save_chat(
@@ -0,0 +1,386 @@
+"""Async (ASGI) mode of the SQL chat backend: the routes of api.py on Quart.
+
+    python src/api_async.py                           # hypercorn on :5002
+    cd src && hypercorn api_async:app --bind 0.0.0.0:5002
+
+In Docker, BACKEND_MODE=async makes the backend service (backend.Dockerfile)
+start this instead of api.py, on the same port.
+
+The pipeline is api.py's -- same prompts, question -> SQL cache, result
+cache, per-user conversation store and chat_history helpers -- but
+nothing blocks the event loop:
+
+- the LLM clients are awaited with ``ainvoke`` / ``astream``; question
+  embeddings, transcription and TTS use the async OpenAI client;
+- the generated SQL, chat_history reads and writes and the schema /
+  data-version checks run on an aiomysql pool (ASYNC_DB_POOL_SIZE +
+  ASYNC_DB_MAX_OVERFLOW connections).
+
+So one process keeps hundreds of chats in flight, where the Flask server
+is capped by its worker threads.
+"""
+import asyncio
+import base64
+import os
+
+from langchain_core.messages import AIMessage, HumanMessage
+from openai import AsyncOpenAI
+from quart import Quart, Response, jsonify, request
+from quart_cors import cors
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import create_async_engine
+
+import api
+from conversations import recent_chat
+from result_cache import read_data_version
+from sql_cache import normalize_question
+
+
+app = cors(Quart(__name__), allow_origin="*")
+client = AsyncOpenAI()
+
+async_engine = create_async_engine(
+    f"mysql+aiomysql://{os.getenv('DB_USER')}:{os.getenv('DB_PASSWORD')}@{os.getenv('DB_HOST')}:3306/{os.getenv('DB_NAME')}",
+    pool_pre_ping=True,
+    pool_size=int(os.getenv("ASYNC_DB_POOL_SIZE", "20")),
+    max_overflow=int(os.getenv("ASYNC_DB_MAX_OVERFLOW", "40")),
+)
+
+# SQLDatabase.run truncates long strings in results to this many characters
+MAX_STRING_LENGTH = 300
+
+
+# =====================================================================
+# 1. DATABASE
+# =====================================================================
+
+async def run_sync(fn, *args):
+    """fn(conn, *args) on a pooled async connection, in one transaction."""
+    async with async_engine.begin() as conn:
+        return await conn.run_sync(fn, *args)
+
+
+def truncate(value):
+    if not isinstance(value, str) or len(value) <= MAX_STRING_LENGTH:
+        return value
+    return value[:MAX_STRING_LENGTH - 3].rsplit(" ", 1)[0] + "..."
+
+
+def read_sql_result(conn, sql):
+    """The result of ``sql`` formatted as SQLDatabase.run does."""
+    cursor = conn.execute(text(sql))
+    if not cursor.returns_rows:
+        return ""
+    rows = [tuple(truncate(value) for value in row) for row in cursor.fetchall()]
+    return str(rows) if rows else ""
+
+
+async def save_chat(usercode, role, message=None, response=None, audio_blob=None):
+    try:
+        await run_sync(api.insert_chat, usercode, role, message, response, audio_blob)
+    except Exception as e:
+        print("Chat save error:", e)
+
+
+async def load_conversation(usercode):
+    """Load a user who is not in memory from chat_history on the async
+    pool, so the store's own loader never blocks the event loop."""
+    if not api.conversations.loaded(usercode):
+        try:
+            messages = await run_sync(recent_chat, usercode, api.conversations.max_messages)
+        except Exception as e:
+            print("Conversation load error:", e)
+            messages = []
+        api.conversations.seed(usercode, messages)
+
+
+async def conversation(usercode):
+    """The user's recent messages, oldest first."""
+    await load_conversation(usercode)
+    return api.conversations.history(usercode)
+
+
+async def remember(usercode, *messages):
+    """Append a turn, reloading the user first if they were evicted
+    while the request ran."""
+    await load_conversation(usercode)
+    api.conversations.append(usercode, *messages)
+
+
+async def refresh_schema():
+    if not api.schema_check_due():
+        return
+    try:
+        columns = await run_sync(api.read_schema_columns)
+    except Exception as e:
+        print("Schema check error:", e)
+        return
+    # A changed schema is re-read with SQLDatabase, which blocks
+    await asyncio.to_thread(api.apply_schema, columns)
+
+
+async def data_version():
+    if not api.data_version_due():
+        return api.version_state["version"]
+    try:
+        api.version_state["version"] = await run_sync(read_data_version)
+    except Exception as e:
+        print("Data version read error:", e)
+        api.version_state["version"] = None
+    return api.version_state["version"]
+
+
+async def run_sql(sql):
+    version = await data_version()
+    result = api.result_cache.get(sql, version)
+    if result is None:
+        result = await run_sync(read_sql_result, sql)
+        api.result_cache.put(sql, version, result)
+    return result
+
+
+# =====================================================================
+# 2. PIPELINE
+# =====================================================================
+
+async def cached_sql(user_query, usercode, role):
+    # Embed here with the async client so the cache never calls the
+    # blocking one
+    if api.sql_cache.missing_vector(user_query, usercode, role):
+        try:
+            embedding = await client.embeddings.create(
+                model=api.EMBEDDING_MODEL, input=normalize_question(user_query)
+            )
+            api.sql_cache.remember_vector(user_query, embedding.data[0].embedding)
+        except Exception as e:
+            print("Question embedding error:", e)
+            return None
+    return api.sql_cache.get(user_query, usercode, role)
+
+
+async def generate_sql(user_question, usercode, role):
+    sql = (await api.llm_sql.ainvoke(api.sql_messages(user_question, usercode, role))).content
+    return api.clean_sql(sql)
+
+
+async def query_stages(user_query, usercode, role):
+    """Async api.query_stages."""
+    await refresh_schema()
+    sql = await cached_sql(user_query, usercode, role)
+    cached = sql is not None
+    if not cached:
+        sql = await generate_sql(user_query, usercode, role)
+    yield "sql", sql
+
+    try:
+        sql_result = await run_sql(sql)
+    except Exception as e:
+        yield "error", f"SQL Error: {e}\nGenerated SQL: {sql}"
+        return
+
+    # Unless its embedding failed (put() would then embed it, blocking)
+    if not cached and not api.sql_cache.missing_vector(user_query, usercode, role):
+        api.sql_cache.put(user_query, usercode, role, sql)
+    yield "rows", sql_result
+
+
+async def process_query(user_query, usercode, role, chat_history):
+    stages = {stage: value async for stage, value in query_stages(user_query, usercode, role)}
+    if "error" in stages:
+        return stages["error"]
+
+    messages = api.answer_messages(user_query, stages["sql"], stages["rows"], chat_history[-2:])
+    if messages is None:
+        return api.NOT_ALLOWED_ANSWER
+    return (await api.llm_answer.ainvoke(messages)).content
+
+
+async def stream_final_answer(question, sql_query, sql_results, chat_history):
+    messages = api.answer_messages(question, sql_query, sql_results, chat_history)
+    if messages is None:
+        yield api.NOT_ALLOWED_ANSWER
+        return
+    async for chunk in api.llm_answer.astream(messages):
+        if chunk.content:
+            yield chunk.content
+
+
+# =====================================================================
+# 3. ROUTES
+# =====================================================================
+
+@app.post("/analyze")
+async def analyze():
+    data = await request.get_json()
+
+    user_query = data.get("query")
+    usercode = data.get("usercode", "")
+    role = data.get("role", "").lower().strip()
+
+    if not user_query:
+        return jsonify({"error": "query field is required"}), 400
+
+    chat_history = await conversation(usercode) + [HumanMessage(content=user_query)]
+
+    try:
+        response = await process_query(user_query, usercode, role, chat_history)
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+    await remember(usercode, chat_history[-1], AIMessage(content=response))
+    await save_chat(usercode, "assistant", message=user_query, response=response)
+
+    return jsonify({
+        "query": user_query,
+        "usercode": usercode,
+        "response": response
+    })
+
+
+@app.post("/analyze/stream")
+async def analyze_stream():
+    """Server-sent events as api.analyze_stream."""
+    data = await request.get_json()
+
+    user_query = data.get("query")
+    usercode = data.get("usercode", "")
+    role = data.get("role", "").lower().strip()
+
+    if not user_query:
+        return jsonify({"error": "query field is required"}), 400
+
+    chat_history = await conversation(usercode) + [HumanMessage(content=user_query)]
+
+    async def events():
+        try:
+            stages = {}
+            async for stage, value in query_stages(user_query, usercode, role):
+                stages[stage] = value
+                if stage == "sql":
+                    yield api.sse("sql", {"sql": value})
+                elif stage == "rows":
+                    yield api.sse("rows", {"empty": value in ("", "[]")})
+
+            if "error" in stages:
+                response = stages["error"]
+                yield api.sse("token", {"text": response})
+            else:
+                pieces = []
+                async for piece in stream_final_answer(
+                    user_query, stages["sql"], stages["rows"], chat_history[-2:]
+                ):
+                    pieces.append(piece)
+                    yield api.sse("token", {"text": piece})
+                response = "".join(pieces)
+        except Exception as e:
+            yield api.sse("error", {"error": str(e)})
+            return
+
+        await remember(usercode, chat_history[-1], AIMessage(content=response))
+        await save_chat(usercode, "assistant", message=user_query, response=response)
+        yield api.sse("done", {"query": user_query, "usercode": usercode, "response": response})
+
+    response = Response(events(), mimetype="text/event-stream",
+                        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+    response.timeout = None
+    return response
+
+
+@app.get("/analyze/cache")
+async def analyze_cache():
+    return jsonify({
+        "sql": api.sql_cache.stats(),
+        "results": api.result_cache.stats(),
+        "conversations": api.conversations.stats(),
+    })
+
+
+@app.get("/analyze/history/<usercode>")
+async def analyze_history(usercode):
+    results = await run_sync(api.select_chat, usercode)
+    return jsonify({
+        "usercode": usercode,
+        "history": results
+    })
+
+
+@app.post("/voice")
+async def voice_input():
+    try:
+        files = await request.files
+        form = await request.form
+        audio_file = files.get("audio")
+        usercode = form.get("usercode", "")
+        role = form.get("role", "").lower().strip()
+
+        if not audio_file:
+            return jsonify({"error": "Audio file is required"}), 400
+
+        audio_bytes = audio_file.read()
+
+        transcript = await client.audio.transcriptions.create(
+            model="gpt-4o-transcribe",
+            file=(audio_file.filename or "audio.webm", audio_bytes),
+            language="en"
+        )
+        transcribed_text = transcript.text.strip()
+
+        chat_history = await conversation(usercode) + [HumanMessage(content=transcribed_text)]
+        reply = await process_query(transcribed_text, usercode, role, chat_history)
+        await remember(usercode, chat_history[-1], AIMessage(content=reply))
+
+        await save_chat(
+            usercode=usercode,
+            role="assistant",
+            message=transcribed_text,
+            response=reply,
+            audio_blob=audio_bytes
+        )
+
+        return jsonify({
+            "voice_text": transcribed_text,
+            "response": reply,
+        })
+
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+
+@app.post("/tts")
+async def tts():
+    try:
+        data = await request.get_json(silent=True) or {}
+        text_input = data.get("text")
+
+        if not text_input:
+            return jsonify({"error": "text is required"}), 400
+
+        response = await client.audio.speech.create(
+            model="gpt-4o-mini-tts",
+            voice="alloy",
+            input=text_input
+        )
+        audio_base64 = base64.b64encode(response.content).decode("utf-8")
+
+        return jsonify({
+            "audio": f"data:audio/mp3;base64,{audio_base64}",
+            "format": "mp3",
+            "message": "success"
+        })
+
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+
+@app.get("/")
+async def home():
+    return {"message": "Fast SQL Chat API (Depot Optional) is running (async)"}
+
+
+if __name__ == "__main__":
+    from hypercorn.asyncio import serve
+    from hypercorn.config import Config
+
+    config = Config()
+    config.bind = ["0.0.0.0:5002"]
+    asyncio.run(serve(app, config))
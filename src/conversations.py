@@ -0,0 +1,148 @@
+"""Per-usercode conversation memory for the chat backends.
+
+Replaces the module-level ``chat_history`` list that every request of
+every user appended to. Each usercode gets a ring buffer of its last
+CONVERSATION_MESSAGES messages. The store keeps at most
+CONVERSATION_USERS users and CONVERSATION_CACHE_MB of message text;
+beyond either limit the least recently active users are dropped. A user
+who is not in memory (new process, or evicted while idle) is rehydrated
+from the chat_history table on first use through ``loader``, so memory
+stays flat however long the process runs.
+
+``recent_chat`` is that read; api.py, api_async.py and retrive.py all
+load through it.
+"""
+import os
+import threading
+from collections import OrderedDict, deque
+
+from langchain_core.messages import AIMessage, HumanMessage
+from sqlalchemy import text
+
+
+MAX_MESSAGES = int(os.getenv("CONVERSATION_MESSAGES", "20"))
+MAX_USERS = int(os.getenv("CONVERSATION_USERS", "10000"))
+CACHE_MB = float(os.getenv("CONVERSATION_CACHE_MB", "32"))
+
+# Rough per-message overhead on top of its text
+MESSAGE_OVERHEAD = 200
+
+
+def message_size(message):
+    return len(message.content) + MESSAGE_OVERHEAD
+
+
+def recent_chat(conn, usercode, limit):
+    """The user's last turns as messages, oldest first, at most ``limit``."""
+    query = text("""
+        SELECT message, response
+        FROM chat_history
+        WHERE usercode = :usercode
+        ORDER BY id DESC
+        LIMIT :limit
+    """)
+    rows = conn.execute(query, {"usercode": usercode, "limit": (limit + 1) // 2}).all()
+
+    messages = []
+    for message, response in reversed(rows):
+        if message:
+            messages.append(HumanMessage(content=message))
+        if response:
+            messages.append(AIMessage(content=response))
+    return messages[-limit:]
+
+
+def chat_loader(engine):
+    """ConversationStore loader reading chat_history through ``engine``."""
+    def load(usercode, limit):
+        with engine.begin() as conn:
+            return recent_chat(conn, usercode, limit)
+    return load
+
+
+class ConversationStore:
+
+    def __init__(self, loader=None, max_messages=MAX_MESSAGES, max_users=MAX_USERS,
+                 max_bytes=int(CACHE_MB * 1024 * 1024)):
+        self.loader = loader            # loader(usercode, limit) -> oldest-first messages
+        self.max_messages = max_messages
+        self.max_users = max_users
+        self.max_bytes = max_bytes
+        self._users = OrderedDict()     # usercode -> deque of messages, idle first
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.loads = 0
+        self.evictions = 0
+
+    def loaded(self, usercode):
+        with self._lock:
+            return usercode in self._users
+
+    def seed(self, usercode, messages):
+        """Start ``usercode``'s buffer with messages from the database,
+        unless a concurrent request already did."""
+        with self._lock:
+            if usercode in self._users:
+                return
+            self._users[usercode] = deque(maxlen=self.max_messages)
+            self.loads += 1
+            self._push(usercode, messages)
+
+    def load(self, usercode):
+        """Rehydrate ``usercode`` from the database if it is not in memory.
+        The loader runs outside the lock."""
+        if self.loader is None or self.loaded(usercode):
+            return
+        try:
+            messages = self.loader(usercode, self.max_messages)
+        except Exception as e:
+            print("Conversation load error:", e)
+            messages = []
+        self.seed(usercode, messages)
+
+    def history(self, usercode):
+        """The user's recent messages, oldest first."""
+        self.load(usercode)
+        with self._lock:
+            buffer = self._users.get(usercode)
+            if buffer is None:
+                return []
+            self._users.move_to_end(usercode)
+            return list(buffer)
+
+    def append(self, usercode, *messages):
+        """Add a turn. A user evicted since their history was read is
+        reloaded first, so the buffer keeps the earlier turns."""
+        self.load(usercode)
+        with self._lock:
+            if usercode not in self._users:
+                self._users[usercode] = deque(maxlen=self.max_messages)
+            self._push(usercode, messages)
+
+    def _push(self, usercode, messages):
+        buffer = self._users[usercode]
+        self._users.move_to_end(usercode)
+        for message in messages:
+            if len(buffer) == buffer.maxlen:
+                self._bytes -= message_size(buffer[0])
+            buffer.append(message)
+            self._bytes += message_size(message)
+
+        # Drop idle users, never the one just written to
+        while len(self._users) > 1 and (
+            len(self._users) > self.max_users or self._bytes > self.max_bytes
+        ):
+            _, evicted = self._users.popitem(last=False)
+            self._bytes -= sum(message_size(message) for message in evicted)
+            self.evictions += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                "users": len(self._users),
+                "max_users": self.max_users,
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "loads": self.loads,
+                "evictions": self.evictions,
+            }
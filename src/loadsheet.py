@@ -1,6 +1,8 @@
 import pandas as pd
 import sqlalchemy
 
+from result_cache import bump_data_version
+
 # =========================================================
 # 1. MYSQL CONNECTION
 # =========================================================
@@ -45,4 +47,8 @@ for sheet_name in xlsx.sheet_names:
 
     print(f"✔ Loaded: {sheet_name} → table `{sheet_name.lower()}`")
 
+# New data: cached /analyze results of the old tables are now stale
+with engine.begin() as conn:
+    bump_data_version(conn)
+
 print("🎉 All sheets loaded into MySQL successfully!")
@@ -0,0 +1,124 @@
+"""Result cache for the SQL that /analyze runs against MySQL.
+
+Results of ``db.run`` are kept per normalized SQL text (whitespace outside
+quoted values collapsed, trailing ";" dropped) for SQL_RESULT_TTL seconds,
+within SQL_RESULT_CACHE_MB of result text; least recently used results go
+first when it is full.
+
+Loaders bump the single row of the ``data_version`` table after writing
+the poc_* tables (``bump_data_version``). Every lookup passes the version
+it read, and a new version empties the cache, so answers never outlive a
+load. Without that table only the TTL applies.
+"""
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+
+from sqlalchemy import text
+
+
+RESULT_TTL = float(os.getenv("SQL_RESULT_TTL", "300"))
+CACHE_MB = float(os.getenv("SQL_RESULT_CACHE_MB", "64"))
+
+TOKEN = re.compile(r"('(?:[^'\\]|\\.)*'|\"(?:[^\"\\]|\\.)*\"|`[^`]*`)|\s+")
+
+
+def normalize_sql(sql):
+    sql = TOKEN.sub(lambda m: m.group(1) or " ", sql).strip()
+    return sql.rstrip(";").strip()
+
+
+# ---------------------------------------------------------
+# DATA VERSION
+# ---------------------------------------------------------
+def ensure_data_version(conn):
+    conn.execute(text("""
+        CREATE TABLE IF NOT EXISTS data_version (
+            id TINYINT NOT NULL PRIMARY KEY,
+            version BIGINT NOT NULL DEFAULT 0,
+            updated_at TIMESTAMP NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP
+        )
+    """))
+
+
+def bump_data_version(conn):
+    """Call in the loader's transaction after writing the poc_* tables."""
+    ensure_data_version(conn)
+    conn.execute(text("""
+        INSERT INTO data_version (id, version) VALUES (1, 1)
+        ON DUPLICATE KEY UPDATE version = version + 1
+    """))
+
+
+def read_data_version(conn):
+    return conn.execute(text("SELECT version FROM data_version WHERE id = 1")).scalar()
+
+
+# ---------------------------------------------------------
+# CACHE
+# ---------------------------------------------------------
+class ResultCache:
+
+    def __init__(self, max_bytes=int(CACHE_MB * 1024 * 1024), ttl=RESULT_TTL):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.version = None
+        self._entries = OrderedDict()   # sql -> (result, expires)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _check_version(self, version):
+        if version != self.version:
+            self.version = version
+            self._entries.clear()
+            self._bytes = 0
+
+    def _drop(self, sql):
+        result, _ = self._entries.pop(sql)
+        self._bytes -= len(sql) + len(result)
+
+    def get(self, sql, version):
+        """Cached result of ``sql`` at data ``version``, or None."""
+        sql = normalize_sql(sql)
+        with self._lock:
+            self._check_version(version)
+            entry = self._entries.get(sql)
+            if entry is not None and entry[1] <= time.monotonic():
+                self._drop(sql)
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(sql)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, sql, version, result):
+        sql = normalize_sql(sql)
+        size = len(sql) + len(result)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            self._check_version(version)
+            if sql in self._entries:
+                self._drop(sql)
+            self._entries[sql] = (result, time.monotonic() + self.ttl)
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                self._drop(next(iter(self._entries)))
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "ttl": self.ttl,
+                "version": self.version,
+                "hits": self.hits,
+                "misses": self.misses,
+            }
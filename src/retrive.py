@@ -9,6 +9,8 @@ from flask_cors import CORS
 from faster_whisper import WhisperModel
 import tempfile
 
+from conversations import ConversationStore, chat_loader
+
 load_dotenv()
 app = Flask(__name__)
 CORS(app, resources={r"/*": {"origins": "*"}}, supports_credentials=True)
@@ -49,7 +51,6 @@ def get_chat_by_usercode(usercode):
 
 
 
-
 def init_database():
     db_uri = f"mysql+mysqlconnector://{os.getenv('DB_USER')}:{os.getenv('DB_PASSWORD')}@{os.getenv('DB_HOST')}:3306/{os.getenv('DB_NAME')}"
 
@@ -235,10 +236,10 @@ def process_query(user_query, usercode, role, chat_history):
 # 8. FLASK API
 # =====================================================================
 
+# Each usercode's recent turns, bounded per user and in total; users not
+# in memory are reloaded from chat_history when they next ask
+conversations = ConversationStore(chat_loader(raw_engine))
 
-chat_history = [
-    AIMessage(content="Hello! I'm your SQL assistant. Ask me anything.")
-]
 
 @app.post("/analyze")
 def analyze():
@@ -251,14 +252,14 @@ def analyze():
     if not user_query:
         return jsonify({"error": "query field is required"}), 400
 
-    chat_history.append(HumanMessage(content=user_query))
+    chat_history = conversations.history(usercode) + [HumanMessage(content=user_query)]
 
     try:
         response = process_query(user_query, usercode, role, chat_history)
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
-    chat_history.append(AIMessage(content=response))
+    conversations.append(usercode, chat_history[-1], AIMessage(content=response))
     save_chat(usercode, "assistant", message=user_query, response=response)
 
     return jsonify({
@@ -301,9 +302,9 @@ def voice_input():
             return jsonify({"error": "Could not transcribe audio"}), 400
 
         # 4. Use existing chatbot pipeline
-        chat_history.append(HumanMessage(content=transcribed_text))
+        chat_history = conversations.history(usercode) + [HumanMessage(content=transcribed_text)]
         reply = process_query(transcribed_text, usercode, role, chat_history)
-        chat_history.append(AIMessage(content=reply))
+        conversations.append(usercode, chat_history[-1], AIMessage(content=reply))
 
         # 5. Save into DB
         save_chat(usercode, "assistant", message=transcribed_text, response=reply)
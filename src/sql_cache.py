@@ -0,0 +1,174 @@
+"""Question -> SQL cache for the /analyze pipeline.
+
+Entries are keyed by (normalized question, usercode, role). A lookup
+first tries the exact key; otherwise it embeds the question and takes the
+most similar cached question of the same usercode and role, if its cosine
+similarity reaches SQL_CACHE_THRESHOLD and it says the same thing: the
+same numbers and quoted values (so "top 5" never reuses the SQL of
+"top 10") and the same content words once filler words and plurals are
+set aside (so "June" never reuses the SQL of "May", nor "max" that of
+"min", nor one brand's that of another). Semantic hits therefore only
+cover rephrasings such as "show me dispatch by depot" / "dispatch by
+depots". A hit skips SQL generation entirely.
+
+The cache holds at most SQL_CACHE_SIZE entries, least recently used go
+first, and it is emptied whenever the schema fingerprint changes.
+"""
+import hashlib
+import os
+import re
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+
+CACHE_SIZE = int(os.getenv("SQL_CACHE_SIZE", "1000"))
+THRESHOLD = float(os.getenv("SQL_CACHE_THRESHOLD", "0.95"))
+
+LITERAL = re.compile(r"\d+(?:\.\d+)?|'[^']*'|\"[^\"]*\"")
+WORD = re.compile(r"\d+(?:\.\d+)?|\w+")
+
+# Words a rephrasing may add or drop without changing the query
+FILLER_WORDS = frozenset("""
+    a an the of for in on at by with is are was were be been please
+    what which show list give tell get find display can could would will
+    do does did me my our us i we you your there that this these those it its
+""".split())
+
+
+def normalize_question(question):
+    question = re.sub(r"\s+", " ", question.strip().lower())
+    return question.rstrip("?.! ")
+
+
+def content_words(question):
+    """Words of a normalized question that change its meaning."""
+    words = set()
+    for word in WORD.findall(question):
+        if word in FILLER_WORDS:
+            continue
+        if len(word) > 3 and word.endswith(("ches", "shes", "sses", "xes")):
+            word = word[:-2]
+        elif len(word) > 3 and word.endswith("s") and not word.endswith("ss"):
+            word = word[:-1]
+        words.add(word)
+    return frozenset(words)
+
+
+def fingerprint(*parts):
+    return hashlib.sha1("\x1f".join(parts).encode("utf-8")).hexdigest()
+
+
+class SQLCache:
+
+    def __init__(self, embed, max_entries=CACHE_SIZE, threshold=THRESHOLD):
+        self.embed = embed              # embed(text) -> list of floats
+        self.max_entries = max_entries
+        self.threshold = threshold
+        self.fingerprint = None
+        self._entries = OrderedDict()   # (question, usercode, role) -> entry
+        self._vectors = OrderedDict()   # question -> unit vector, for put()
+        self._lock = threading.Lock()
+        self.hits = {"exact": 0, "semantic": 0}
+        self.misses = 0
+
+    def check_fingerprint(self, schema_fingerprint):
+        """Empty the cache if the schema changed since the last check."""
+        with self._lock:
+            if schema_fingerprint != self.fingerprint:
+                self.fingerprint = schema_fingerprint
+                self._entries.clear()
+                self._vectors.clear()
+
+    def missing_vector(self, question, usercode, role):
+        """Whether get() / put() of the question may have to call embed;
+        async callers embed it themselves first (remember_vector)."""
+        question = normalize_question(question)
+        with self._lock:
+            return (question, usercode, role) not in self._entries \
+                and question not in self._vectors
+
+    def remember_vector(self, question, vector):
+        vector = np.asarray(vector, dtype=np.float32)
+        vector /= np.linalg.norm(vector) or 1.0
+        with self._lock:
+            self._vectors[normalize_question(question)] = vector
+            while len(self._vectors) > self.max_entries:
+                self._vectors.popitem(last=False)
+        return vector
+
+    def _vector(self, question):
+        with self._lock:
+            vector = self._vectors.get(question)
+        if vector is None:
+            vector = self.remember_vector(question, self.embed(question))
+        return vector
+
+    def get(self, question, usercode, role):
+        """Cached SQL for the question, or None."""
+        question = normalize_question(question)
+        key = (question, usercode, role)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits["exact"] += 1
+                return entry["sql"]
+            literals = LITERAL.findall(question)
+            words = content_words(question)
+            candidates = [
+                (cached_key, entry) for cached_key, entry in self._entries.items()
+                if cached_key[1:] == (usercode, role) and entry["literals"] == literals
+                and entry["words"] == words
+            ]
+
+        if candidates:
+            try:
+                vector = self._vector(question)
+            except Exception as e:
+                print("Question embedding error:", e)
+                candidates = []
+
+        if candidates:
+            similarity = np.stack([entry["vector"] for _, entry in candidates]) @ vector
+            best = int(np.argmax(similarity))
+            if similarity[best] >= self.threshold:
+                cached_key, entry = candidates[best]
+                with self._lock:
+                    if cached_key in self._entries:
+                        self._entries.move_to_end(cached_key)
+                    self.hits["semantic"] += 1
+                return entry["sql"]
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put(self, question, usercode, role, sql):
+        question = normalize_question(question)
+        try:
+            vector = self._vector(question)
+        except Exception as e:
+            print("Question embedding error:", e)
+            return
+
+        with self._lock:
+            self._entries[(question, usercode, role)] = {
+                "sql": sql, "vector": vector, "literals": LITERAL.findall(question),
+                "words": content_words(question),
+            }
+            self._entries.move_to_end((question, usercode, role))
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "threshold": self.threshold,
+                "hits": dict(self.hits),
+                "misses": self.misses,
+                "fingerprint": self.fingerprint,
+            }